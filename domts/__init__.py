@@ -1,52 +1,533 @@
 """ Python Document Object Model Test Suite. Interprets test suites from the
     W3C DOMTS project and carries them out against known Python DOM
-    implementations. Requires Python 2.0 or later.
+    implementations. Requires Python 2.5 or later.
 """
 
-__all__= [ 'runSuite',
-  'implementations', 'inbuilts', 'interfaces', 'interpreter', 'imitation'
+__all__= [ 'runSuite', 'iterSuite', 'iterBenchmark', 'Reporter',
+  'implementations', 'inbuilts', 'interfaces', 'interpreter', 'imitation',
+  'expressions', 'tsml', 'store', 'reporting',
+  'benchmark', 'profiling', 'timing', 'features'
 ]
 __version__= '0.6'
 
-import os, sys
+import os, sys, gc, time
+try:
+  import cPickle as pickle
+except ImportError:
+  import pickle
+import implementations, tsml
 from implementations import *
 from interpreter import *
+from interpreter import NonErrors, sstr
+from interrupter import getWatchdog, UnresponsiveDOMTimeoutInterrupt
 from imitation import *
+from store import DocumentCache, ResultStore
+from reporting import Reporter, Result
+from timing import PhaseClock, measured
+from features import FeatureIndex, Capabilities
+import benchmark
+import profiling
 
-def runSuite(suitePath, testImp, workImp):
+def runSuite(suitePath, testImp, workImp, workers= 1, **options):
   """ Run a suite of tests, given the filename of the suite or test document.
-      Test a particular named implementation, using a second named
-      implementation to do internal XML-related tasks. Omit either for a
-      default DOM. Return a list of (testName, passedFlag, skippedFlag,
-      failInfo) tuples.
+      Test a particular Implementation. Test documents are read by
+      domts.tsml; workImp, if not None, is a second Implementation used to
+      read any that tsml can't. Return a list of reporting.Result records,
+      which can be used as (testName, passedFlag, skippedFlag, failInfo)
+      tuples; failInfo is the failure or skip message, or None.
+
+      If workers is more than one, the suite's tests are shared out between
+      that many processes, each with its own test and work implementations
+      created from implementations.IMPLEMENTATIONS. Results are still
+      returned in suite order.
+
+      Further keyword options are those of Runner:
+
+      cacheDir: test and suite documents are stored in this directory in a
+      compact form after parsing, and read back on later runs instead of
+      being parsed again.
+
+      cacheFixtures: if true, the files tests <load> are parsed only once by
+      the test implementation and then copied (or shared, for tests that say
+      they will not modify them).
+
+      storeDir: results are stored in this directory, and reused on later
+      runs for tests whose file, fixture files and tested implementation have
+      not changed since. rerun: if true, run every test regardless, updating
+      the stored results.
+
+      profiler: an object whose timed method wraps DOM calls and TSML
+      statements, such as a profiling.Profiler. With several workers, each
+      gathers its own counts, which are merged back into this one.
+
+      timings: if true, each result's timings attribute breaks the time the
+      test took down into the phases listed in timing.PHASES. Garbage is
+      collected after each test rather than during it, so that it can be
+      timed separately. Results reused from storeDir have no timings.
+
+      indexDir: the features and fixed implementation attributes each test
+      requires are kept in this directory, along with what the tested
+      implementation supports. Tests it does not support are then marked
+      as skipped on later runs without being parsed or run.
+
+      timeout: if given, each test is run in a child process forked for it,
+      which is killed if it takes longer than this many seconds; the test
+      then fails and the suite carries on. Needs os.fork. memoryLimit: the
+      most memory in bytes such a child may use (implies a timeout of
+      TIMEOUT seconds if none is given).
+
+      tempRoot: directory for the temporary files tests create, instead of
+      /dev/shm or the system's temporary directory. Each test's files go in
+      a directory of their own, removed when it finishes.
+
+      iteration: how <for-each> loops go through their collections - 'auto'
+      (the default) reads the collection as the loop goes unless the loop
+      could change it, when it is copied first; 'snapshot' always copies it
+      and 'stream' never does. Each Tester counts the loops run each way in
+      its iterations dictionary.
+  """
+  return list(apply(iterSuite, (suitePath, testImp, workImp, workers), options))
+
+
+def iterSuite(suitePath, testImp, workImp, workers= 1, **options):
+  """ Run a suite of tests as runSuite does, but return an iterator that
+      yields each Result as soon as its test has finished.
   """
-  imitate()
-  workImp.beginWork()
-  suiteDoc= workImp.parseFile(suitePath)
   basePath= os.path.dirname(suitePath)
-  filesPath= os.path.join(basePath, 'files')
-  tester= Tester(testImp, filesPath)
-  try:
-    workImp.setImplementationAttribute('expandEntityReferences', 1)
-  except NotImplementedError:
-    pass
+  runner= apply(Runner, (basePath, testImp, workImp), options)
+  suiteDoc= runner.parse(suitePath)
 
   if suiteDoc.documentElement.nodeName=='test':
-    testImp.beginTest()
-    return [tester.runTest(suiteDoc)]
+    yield runner.run(os.path.basename(suitePath))
   elif suiteDoc.documentElement.nodeName=='suite':
-    results= []
-    for member in suiteDoc.getElementsByTagName('suite.member'):
+    hrefs= suiteMembers(suiteDoc)
+    results= None
+    if workers>1 and len(hrefs)>1:
       try:
-        workImp.beginWork()
-        testPath= os.path.join(basePath, member.getAttribute('href'))
-        testDoc= workImp.parseFile(testPath)
-        if testDoc.documentElement.tagName=='test':
-          testImp.beginTest()
-          results.append(tester.runTest(testDoc))
-      except:
-        sys.stderr.write('Test %s died...\n' % testPath)
-        raise
-    return results
+        import multiprocessing
+      except ImportError:
+        pass
+      else:
+        results= iterParallel(basePath, hrefs, testImp, workImp, workers,
+          options
+        )
+    if results is None:
+      results= iterSerial(runner, hrefs)
+    for result in results:
+      yield result
   else:
     raise Exception('Unknown XML file, not test or suite of tests')
+
+
+def suiteMembers(suiteDoc):
+  hrefs= []
+  for member in suiteDoc.getElementsByTagName('suite.member'):
+    hrefs.append(member.getAttribute('href'))
+  return hrefs
+
+def iterSerial(runner, hrefs):
+  for href in hrefs:
+    result= runner.run(href)
+    if result is not None:
+      yield result
+
+
+# Default timeout in seconds for tests run in child processes, when a memory
+# limit is set without one
+#
+TIMEOUT= 300
+
+# Number of tests between full garbage collections
+#
+COLLECT= 50
+
+
+class Runner:
+  """ Runs the members of a suite within one process, with the Tester and
+      the caches and stores asked for.
+  """
+  def __init__(self, basePath, testImp, workImp, cacheDir= None,
+    cacheFixtures= False, storeDir= None, rerun= False, profiler= None,
+    timings= False, indexDir= None, timeout= None, memoryLimit= None,
+    tempRoot= None, iteration= 'auto'
+  ):
+    self.basePath= basePath
+    self.testImp= testImp
+    self.workImp= workImp
+    filesPath= os.path.join(basePath, 'files')
+    self.clock= None
+    if timings:
+      self.clock= PhaseClock(profiler)
+      self.tester= Tester(testImp, filesPath, cacheFixtures= cacheFixtures,
+        profiler= self.clock, tempRoot= tempRoot, iteration= iteration
+      )
+    else:
+      self.tester= Tester(testImp, filesPath, cacheFixtures= cacheFixtures,
+        profiler= profiler, tempRoot= tempRoot, iteration= iteration
+      )
+    self.cache= None
+    if cacheDir is not None:
+      self.cache= DocumentCache(cacheDir, __version__)
+    self.results= None
+    if storeDir is not None:
+      self.results= ResultStore(storeDir, __version__, testImp, filesPath, (
+        ('cacheFixtures', not not cacheFixtures), ('iteration', iteration)
+      ))
+    self.rerun= rerun
+    self.profiler= profiler
+    self.tests= 0
+    self.timeout= timeout
+    self.memoryLimit= memoryLimit
+    if timeout is None and memoryLimit is not None:
+      self.timeout= TIMEOUT
+    self.index= None
+    if indexDir is not None:
+      self.index= FeatureIndex(indexDir, __version__)
+      self.capabilities= Capabilities(indexDir, __version__, self.tester)
+    self.readerName= 'tsml'
+    if workImp is not None:
+      self.readerName= 'tsml/'+workImp.implementationName
+      try:
+        workImp.setImplementationAttribute('expandEntityReferences', 1)
+      except NotImplementedError:
+        pass
+
+  def parse(self, path):
+    """ Read a test or suite document as a tsml.Document, through the
+        DocumentCache if there is one.
+    """
+    if self.cache is not None:
+      return self.cache.parse(path, self.read, self.readerName)
+    return self.read(path)
+
+  def read(self, path):
+    """ Read a document with tsml's own reader, or if it can't be read that
+        way and there is a work implementation, with that.
+    """
+    try:
+      return tsml.parse(path)
+    except tsml.ParseError:
+      if self.workImp is None:
+        raise
+    self.workImp.beginWork()
+    return tsml.fromDOM(self.workImp.parseFile(path))
+
+  def run(self, href):
+    """ Run a single suite member. Return its Result, or None if the member
+        is not a test document.
+    """
+    testPath= os.path.join(self.basePath, href)
+    try:
+      result= self.lookup(testPath)
+      if result is None:
+        if self.timeout is None:
+          result= self.runMember(testPath)
+        else:
+          result= self.runIsolated(testPath)
+    except:
+      sys.stderr.write('Test %s died...\n' % testPath)
+      raise
+    return result
+
+  def lookup(self, testPath):
+    """ Return a result for a suite member known without running it, from the
+        result store or feature index, or None.
+    """
+    if self.results is not None and not self.rerun:
+      result= self.results.lookup(testPath)
+      if result is not None:
+        return apply(Result, tuple(result), {'path': testPath})
+    if self.index is not None:
+      indexed= self.index.lookup(testPath)
+      if indexed is not None:
+        (testName, required)= indexed
+        skip= self.capabilities.check(required)
+        if skip is not None:
+          return Result(testName, False, True, skip, path= testPath)
+    return None
+
+  def runMember(self, testPath):
+    parseTimes= None
+    if self.clock is None:
+      testDoc= self.parse(testPath)
+    else:
+      (testDoc, parseTimes)= measured(self.parse, testPath)
+    if testDoc.documentElement.tagName!='test':
+      return None
+    if self.index is not None and self.index.lookup(testPath) is None:
+      self.index.add(testPath, testDoc)
+    return self.runTest(testPath, testDoc, parseTimes)
+
+  def runIsolated(self, testPath):
+    """ Run a suite member as runMember does, but in a child process forked
+        from this one, so the implementations are already loaded. If the
+        child takes longer than the timeout it is killed and the test
+        failed; likewise if it dies, or runs out of the memory allowed it.
+        Anything the test does to the state of this process, such as caching
+        fixtures, is lost.
+    """
+    import select, signal
+    sys.stdout.flush()
+    sys.stderr.flush()
+    (readEnd, writeEnd)= os.pipe()
+    pid= os.fork()
+    if pid==0:
+      os.close(readEnd)
+      self.runChild(testPath, writeEnd)
+    os.close(writeEnd)
+    data= []
+    deadline= time.time()+self.timeout
+    timedOut= False
+    try:
+      while True:
+        remaining= deadline-time.time()
+        if remaining<=0 or len(select.select([readEnd], [], [], remaining)[0])==0:
+          timedOut= True
+          break
+        chunk= os.read(readEnd, 65536)
+        if chunk=='':
+          break
+        data.append(chunk)
+    finally:
+      os.close(readEnd)
+      if timedOut:
+        try:
+          os.kill(pid, signal.SIGKILL)
+        except OSError:
+          pass
+      status= os.waitpid(pid, 0)[1]
+      self.tester.removeTempDirs(pid)
+
+    if timedOut:
+      sys.stderr.write('Test %s killed after %s seconds.\n' % (
+        testPath, self.timeout
+      ))
+      return self.failure(testPath, UnresponsiveDOMTimeoutInterrupt(
+        'Test killed after %s seconds' % self.timeout
+      ))
+    try:
+      (kind, value, profile)= pickle.loads(''.join(data))
+    except NonErrors:
+      raise
+    except Exception:
+      if os.WIFSIGNALED(status):
+        return self.failure(testPath, Exception(
+          'Test process killed by signal %d' % os.WTERMSIG(status)
+        ))
+      return self.failure(testPath, Exception(
+        'Test process exited with status %d' % os.WEXITSTATUS(status)
+      ))
+    if profile is not None:
+      self.profiler.merge(profile)
+    if kind=='error':
+      raise value
+    return value
+
+  def runChild(self, testPath, writeEnd):
+    """ Run a suite member in the child process made by runIsolated, and send
+        back ('result', result, profile) or ('error', exception, profile)
+        through the pipe. Never returns.
+    """
+    status= 0
+    try:
+      try:
+        if self.memoryLimit is not None:
+          import resource
+          resource.setrlimit(resource.RLIMIT_AS,
+            (self.memoryLimit, self.memoryLimit)
+          )
+        self.tester.watchdog= getWatchdog()
+        # The profiler came with the totals of earlier tests; send back only
+        # what this one adds
+        #
+        if hasattr(self.profiler, 'drain'):
+          self.profiler.drain()
+        try:
+          message= ('result', self.runMember(testPath))
+        except MemoryError:
+          message= ('result', self.failure(testPath, MemoryError(
+            'Test ran out of memory'
+          )))
+        except:
+          message= ('error', sys.exc_info()[1])
+        profile= None
+        if hasattr(self.profiler, 'drain'):
+          profile= self.profiler.drain()
+        try:
+          data= pickle.dumps(message+(profile,), 1)
+          pickle.loads(data)
+        except NonErrors:
+          raise
+        except Exception:
+          data= pickle.dumps(
+            ('error', Exception(sstr(message[1])), profile), 1
+          )
+        while data!='':
+          data= data[os.write(writeEnd, data):]
+        sys.stdout.flush()
+        sys.stderr.flush()
+      except:
+        status= 1
+    finally:
+      os._exit(status)
+
+  def failure(self, testPath, exception):
+    """ Return a failed result for a test that could not report its own. The
+        test is named after its file, as DOMTS tests are.
+    """
+    testName= os.path.splitext(os.path.basename(testPath))[0]
+    return Result(testName, False, False, exception, path= testPath)
+
+  def runTest(self, testPath, testDoc, parseTimes= None):
+    timings= None
+    if self.clock is None:
+      self.testImp.beginTest()
+      collecting= gc.isenabled()
+      gc.disable()
+      try:
+        result= self.tester.runTest(testDoc)
+      finally:
+        if collecting:
+          gc.enable()
+      if collecting:
+        self.collect()
+    else:
+      (result, timings)= self.runTimed(testDoc, parseTimes)
+    result= apply(Result, tuple(result), {'timings': timings, 'path': testPath})
+    if self.results is not None:
+      self.results.save(testPath, testDoc, result)
+    return result
+
+  def collect(self):
+    """ Collect garbage between tests, automatic collection having been
+        turned off during them. The youngest generation is collected after
+        every test, and everything after every COLLECT tests.
+    """
+    self.tests= self.tests+1
+    if self.tests%COLLECT==0:
+      gc.collect()
+    else:
+      gc.collect(0)
+
+  def runTimed(self, testDoc, parseTimes):
+    """ Run a test as runTest does, returning its result tuple and a
+        dictionary of timings.
+    """
+    timings= {}
+    if parseTimes is not None:
+      timings['parse']= parseTimes
+    timings['begin']= measured(self.testImp.beginTest)[1]
+    self.clock.reset()
+    collecting= gc.isenabled()
+    gc.disable()
+    try:
+      (result, (wall, cpu))= measured(self.tester.runTest, testDoc)
+    finally:
+      if collecting:
+        gc.enable()
+    timings['gc']= measured(gc.collect)[1]
+    for phase in ('load', 'dom'):
+      timings[phase]= tuple(self.clock.times[phase])
+      wall= wall-self.clock.times[phase][0]
+      cpu= cpu-self.clock.times[phase][1]
+    timings['interpreter']= (wall, cpu)
+    return (result, timings)
+
+
+def iterBenchmark(suitePath, testImp, workImp, repeat= benchmark.REPEAT,
+  warmup= benchmark.WARMUP, **options
+):
+  """ Use the tests in a suite as benchmarks of the test implementation.
+      Each test that passes is run warmup times, then timed over repeat more
+      runs. Only time spent in DOM calls and in parsing loaded documents is
+      counted. Yield a (testName, domTimes, totalTimes) tuple for each test,
+      where the times are lists of seconds for each timed run; totalTimes
+      includes the interpreter's own time.
+  """
+  if repeat<1 or warmup<0:
+    raise ValueError('Need at least one timed run and no negative warmup')
+  clock= benchmark.DOMClock()
+  options['profiler']= clock
+  basePath= os.path.dirname(suitePath)
+  runner= apply(Runner, (basePath, testImp, workImp), options)
+  tester= runner.tester
+  suiteDoc= runner.parse(suitePath)
+  if suiteDoc.documentElement.nodeName=='test':
+    testDocs= [suiteDoc]
+  else:
+    testDocs= []
+    for href in suiteMembers(suiteDoc):
+      testDocs.append(os.path.join(basePath, href))
+
+  for testDoc in testDocs:
+    if type(testDoc) in (type(''), type(u'')):
+      testDoc= runner.parse(testDoc)
+      if testDoc.documentElement.tagName!='test':
+        continue
+    testRoot= testDoc.documentElement
+    testName= testRoot.getAttribute('name')
+    program= tester.compile(testRoot.childNodes)
+    domTimes= []
+    totalTimes= []
+    for run in range(warmup+repeat+1):
+      testImp.beginTest()
+      clock.reset()
+      start= benchmark.timer()
+      result= tester.runCompiled(testName, program)
+      total= benchmark.timer()-start
+      if not result[1]:
+        break
+      if run>warmup:
+        domTimes.append(clock.total)
+        totalTimes.append(total)
+    else:
+      yield (testName, domTimes, totalTimes)
+
+
+# Parallel running. Each worker process holds its own implementations in a
+# Runner, made by initWorker, in the global worker.
+#
+worker= None
+
+def iterParallel(basePath, hrefs, testImp, workImp, workers, options):
+  import multiprocessing
+  workImpName= None
+  if workImp is not None:
+    workImpName= workImp.implementationName
+  pool= multiprocessing.Pool(workers, initWorker, (
+    basePath, testImp.implementationName, workImpName, options
+  ))
+  profiler= options.get('profiler')
+  finished= False
+  try:
+    chunksize= max(1, len(hrefs)/(workers*16))
+    for (result, profile) in pool.imap(runWorker, hrefs, chunksize):
+      if profile is not None:
+        profiler.merge(profile)
+      if result is not None:
+        yield result
+    finished= True
+  finally:
+    if finished:
+      pool.close()
+    else:
+      pool.terminate()
+    pool.join()
+
+def initWorker(basePath, testImpName, workImpName, options):
+  global worker
+  testImp= implementations.IMPLEMENTATIONS[testImpName.lower()]()
+  workImp= None
+  if workImpName is not None:
+    workImp= implementations.IMPLEMENTATIONS[workImpName.lower()]()
+  worker= apply(Runner, (basePath, testImp, workImp), options)
+
+def runWorker(href):
+  """ Run a suite member in a worker. Return its result, and any profile
+      counts gathered since the last member.
+  """
+  result= worker.run(href)
+  profile= None
+  if hasattr(worker.profiler, 'drain'):
+    profile= worker.profiler.drain()
+  return (result, profile)
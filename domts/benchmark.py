@@ -0,0 +1,52 @@
+""" domts.benchmark: time TSML tests as microbenchmarks of the DOM under test.
+    Only time spent inside calls to the DOM (and in parsing documents the test
+    loads) is counted, so the cost of the interpreter itself is left out.
+"""
+
+__all__= ['DOMClock', 'summarise', 'REPEAT', 'WARMUP']
+
+from timeit import default_timer as timer
+
+# Default number of timed runs of each test, and of untimed runs first
+#
+REPEAT= 20
+WARMUP= 3
+
+class DOMClock:
+  """ Profiler for a Tester that adds up the time spent in DOM calls. When a
+      DOM call calls back into the test (eg. an event listener or filter),
+      DOM calls made by the callback are not counted again. Whole TSML
+      statements are not timed.
+  """
+  def __init__(self):
+    self.total= 0.0
+    self.depth= 0
+  def reset(self):
+    self.total= 0.0
+  def timed(self, kind, name, call):
+    if kind=='element':
+      return call
+    def timedCall(*args):
+      self.depth= self.depth+1
+      start= timer()
+      try:
+        return apply(call, args)
+      finally:
+        self.depth= self.depth-1
+        if self.depth==0:
+          self.total= self.total+(timer()-start)
+    return timedCall
+
+
+def summarise(times):
+  """ Return (minimum, median, 95th percentile) of a list of times.
+  """
+  times= list(times)
+  times.sort()
+  n= len(times)
+  if n%2==1:
+    median= times[n/2]
+  else:
+    median= (times[n/2-1]+times[n/2])/2.0
+  p95= times[max(0, -(-n*95/100)-1)]
+  return (times[0], median, p95)
@@ -0,0 +1,100 @@
+""" domts.expressions: cache of compiled TSML expressions. Expression strings
+    are compiled to code objects once and shared by every test in a run;
+    expressions that are just literals are evaluated once and remembered.
+"""
+
+__all__= ['ExpressionCache', 'EXPRESSIONS']
+
+try: True
+except NameError: globals()['True'],globals()['False']= not None, not not None
+
+# Default maximum number of expressions held
+#
+SIZE= 8192
+
+# Types of literal value that are safe to share between evaluations
+#
+IMMUTABLES= (
+  type(''), type(u''), type(0), type(0L), type(0.0), type(0j), type(None),
+  type(True)
+)
+
+class ExpressionCache:
+  """ Least-recently-used cache of expression strings to compiled code.
+      Records hits and misses in the properties of the same name.
+  """
+  def __init__(self, size= SIZE):
+    self.size= size
+    self.entries= {}
+    self.tick= 0
+    self.hits= 0
+    self.misses= 0
+
+  def lookup(self, expr):
+    """ Return a (constant, value) pair for an expression string. If constant
+        is true, value is the result of the expression; otherwise it is a
+        code object to be evaluated in the test's scope.
+    """
+    self.tick= self.tick+1
+    entry= self.entries.get(expr)
+    if entry is not None:
+      self.hits= self.hits+1
+      entry[0]= self.tick
+      return entry[1]
+    self.misses= self.misses+1
+    if len(self.entries)>=self.size:
+      self.evict()
+    compiled= compileExpression(expr)
+    self.entries[expr]= [self.tick, compiled]
+    return compiled
+
+  def evict(self):
+    """ Drop the least recently used half of the entries. Done in bulk so the
+        cost of finding them is spread over many misses.
+    """
+    if len(self.entries)==0:
+      return
+    ticks= []
+    for entry in self.entries.values():
+      ticks.append(entry[0])
+    ticks.sort()
+    threshold= ticks[(len(ticks)-1)/2]
+    for (expr, entry) in self.entries.items():
+      if entry[0]<=threshold:
+        del self.entries[expr]
+
+  def clear(self):
+    self.entries= {}
+    self.hits= 0
+    self.misses= 0
+
+  def stats(self):
+    return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def compileExpression(expr):
+  """ Compile an expression string. TSML expressions are compatible with
+      Python except that in pre-2.3 Pythons Unicode characters can't be
+      included directly. Assuming they are in a string literal, encode them in
+      \u format and u-prefix the literal. If the expression refers to no names
+      and gives an immutable value, fold it to that constant.
+  """
+  if type(expr)==type(u'') and expr[:1]=='"':
+    ascii= []
+    for char in expr:
+      if ord(char)>=128:
+        ascii.append('\\u%04x' % ord(char))
+      else:
+        ascii.append(str(char))
+    expr= 'u'+''.join(ascii)
+  code= compile(expr, '<TSML expression>', 'eval')
+  if len(code.co_names)==0:
+    value= eval(code, {})
+    if type(value) in IMMUTABLES:
+      return (True, value)
+  return (False, code)
+
+
+# Cache shared by all Testers unless given their own
+#
+EXPRESSIONS= ExpressionCache()
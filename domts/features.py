@@ -0,0 +1,176 @@
+""" domts.features: find out which tests an implementation will skip without
+    running them. Most tests begin by declaring the features and fixed
+    implementation attributes they need; these are read from the test once
+    and kept in an index on disk, and checked against a profile of what the
+    tested implementation supports, also kept on disk.
+"""
+
+__all__= ['requirements', 'FeatureIndex', 'Capabilities']
+
+import os, marshal
+try:
+  from hashlib import md5
+except ImportError:
+  from md5 import new as md5
+from inbuilts import CONSTANTS, IGNORE
+from interfaces import SIMPLEOBJECTS
+from expressions import EXPRESSIONS
+from store import readFile, writeFile
+from interpreter import sstr
+try: True
+except NameError: globals()['True'],globals()['False']= not None, not not None
+
+class NotStatic(Exception):
+  """ An expression depends on something only known when the test runs.
+  """
+
+def staticValue(expr, declared= ()):
+  """ Return the value of an expression that uses only literals and
+      CONSTANTS not hidden by declared variable names, or raise NotStatic.
+  """
+  try:
+    (constant, value)= EXPRESSIONS.lookup(expr)
+  except SyntaxError:
+    raise NotStatic(expr)
+  if constant:
+    return value
+  for name in value.co_names:
+    if not CONSTANTS.has_key(name) or name in declared:
+      raise NotStatic(expr)
+  return eval(value, CONSTANTS.copy())
+
+def isDeclaration(element):
+  """ Is an element a plain <var> declaration, with no initial value and
+      nothing to do when executed that could fail?
+  """
+  if element.tagName!='var':
+    return False
+  if element.hasAttribute('value') or element.hasAttribute('isNull'):
+    return False
+  if SIMPLEOBJECTS.has_key(element.getAttribute('type')):
+    return False
+  for child in element.childNodes:
+    if child.nodeType==child.ELEMENT_NODE:
+      return False
+  return True
+
+def requirements(testDoc):
+  """ Return the requirements a test checks before doing anything else, as a
+      tuple of ('hasFeature', feature, version) and ('implementationAttribute',
+      name, value) tuples in the order the test checks them. Comments,
+      metadata and plain variable declarations are passed over; the list ends
+      at the first statement that does something else, or whose expressions
+      can't be worked out without running the test.
+  """
+  found= []
+  declared= []
+  for child in testDoc.documentElement.childNodes:
+    if child.nodeType!=child.ELEMENT_NODE:
+      continue
+    tagName= child.tagName
+    try:
+      if tagName=='hasFeature' and not child.hasAttribute('obj'):
+        found.append(('hasFeature',
+          staticValue(child.getAttribute('feature'), declared),
+          staticValue(child.getAttribute('version') or 'null', declared)
+        ))
+      elif tagName=='implementationAttribute':
+        found.append(('implementationAttribute',
+          child.getAttribute('name'),
+          staticValue(child.getAttribute('value'), declared)
+        ))
+      elif isDeclaration(child):
+        declared.append(child.getAttribute('name'))
+      elif tagName in IGNORE:
+        pass
+      else:
+        break
+    except NotStatic:
+      break
+  return tuple(found)
+
+
+class FeatureIndex:
+  """ Index on disk of the name and requirements of each test file, keyed by
+      a hash of the file's content and the domts version, so a test need not
+      be parsed to see what it requires.
+  """
+  def __init__(self, directory, version):
+    self.directory= directory
+    self.version= version
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  def entry(self, testPath):
+    digest= md5(self.version+'\0')
+    digest.update(readFile(testPath))
+    return os.path.join(self.directory, digest.hexdigest()+'.req')
+
+  def lookup(self, testPath):
+    """ Return (testName, requirements) for a test file, or None if it has not
+        been indexed since it last changed.
+    """
+    try:
+      return marshal.loads(readFile(self.entry(testPath)))
+    except (IOError, EOFError, ValueError, TypeError):
+      return None
+
+  def add(self, testPath, testDoc):
+    testName= testDoc.documentElement.getAttribute('name')
+    writeFile(self.entry(testPath),
+      marshal.dumps((testName, requirements(testDoc)))
+    )
+
+
+class Capabilities:
+  """ Which requirements a test implementation meets, found out by asking it
+      the first time each is met and remembered on disk by the
+      implementation's identity. Only fixed implementation attributes are
+      judged: whether others can be set depends on what was set before.
+  """
+  def __init__(self, directory, version, tester):
+    self.tester= tester
+    implementation= tester.implementation
+    digest= md5('%s\0%s' % (version, implementation.identity()))
+    self.path= os.path.join(directory, digest.hexdigest()+'.cap')
+    try:
+      self.known= marshal.loads(readFile(self.path))
+    except (IOError, EOFError, ValueError, TypeError):
+      self.known= {}
+
+  def check(self, requirements):
+    """ Return the NotImplementedError a test with the given requirements
+        would be skipped with, or None if it can't be said without running
+        the test.
+    """
+    for requirement in requirements:
+      message= self.known.get(requirement, 0)
+      if message==0:
+        message= self.probe(requirement)
+        if message==0:
+          return None
+        self.known[requirement]= message
+        writeFile(self.path, marshal.dumps(self.known))
+      if message is not None:
+        return NotImplementedError(message)
+    return None
+
+  def probe(self, requirement):
+    """ Return the message a requirement fails with, None if it is met, or 0
+        if it can't be known in advance.
+    """
+    (kind, name, value)= requirement
+    implementation= self.tester.implementation
+    if kind=='implementationAttribute':
+      if not implementation.fixedAttributes.has_key(name):
+        return 0
+      try:
+        implementation.setImplementationAttribute(name, value)
+      except NotImplementedError, e:
+        return sstr(e)
+      return None
+    try:
+      self.tester.checkFeature(name, value)
+    except NotImplementedError, e:
+      return sstr(e)
+    return None
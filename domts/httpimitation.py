@@ -0,0 +1,67 @@
+""" domts.httpimitation: the HTTP side of domts.imitation - the request
+    handler for the imitation server, and the in-process urllib2 handler.
+"""
+
+__all__= ['Imitation', 'MemoryHandler']
+
+import BaseHTTPServer, urllib2, mimetools
+from imitation import memory, MEMORYHOST, StringIO
+
+class Imitation(BaseHTTPServer.BaseHTTPRequestHandler):
+  def do_GET(self):
+    if memory.write(self.path, self.wfile, self.startGET):
+      self.wfile.close()
+    else:
+      self.send_error(404)
+  def startGET(self, length):
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/xml')
+    self.send_header('Content-Length', str(length))
+    self.end_headers()
+  def do_PUT(self):
+    length= int(self.headers.getheader('Content-Length', '0'))
+    memory.put(self.path, self.rfile, length)
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain')
+    self.end_headers()
+    self.wfile.write('OK')
+    self.wfile.close()
+
+  def log_request(a= None, b= None):
+    pass
+
+
+class MemoryHandler(urllib2.BaseHandler):
+  """ urllib2 handler for http URIs on MEMORYHOST, answering from memory as
+      the imitation server would. A request with data stores it; one without
+      fetches what was stored. Requests for other hosts are left to the
+      normal handlers.
+  """
+  handler_order= 100
+
+  def http_open(self, request):
+    if request.get_host()!=MEMORYHOST:
+      return None
+    path= request.get_selector()
+    url= request.get_full_url()
+    if request.has_data():
+      data= request.get_data()
+      if hasattr(data, 'read'):
+        memory.put(path, data)
+      else:
+        memory[path]= data
+      return self.response(url, 'text/plain', 'OK')
+    if not memory.has_key(path):
+      raise urllib2.HTTPError(url, 404, 'Not Found',
+        mimetools.Message(StringIO('')), StringIO('')
+      )
+    return self.response(url, 'text/xml', memory[path])
+
+  def response(self, url, contentType, data):
+    headers= mimetools.Message(StringIO(
+      'Content-Type: %s\r\nContent-Length: %d\r\n\r\n' % (contentType,len(data))
+    ))
+    response= urllib2.addinfourl(StringIO(data), headers, url)
+    response.code= 200
+    response.msg= 'OK'
+    return response
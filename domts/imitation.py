@@ -1,40 +1,174 @@
 """ domts.imitation: pretend to be a remote web server supporting GET and
     PUT requests, for DOM Level 3 LS tests.
+
+    The server is only started the first time a test asks for an http URI,
+    on a port the system picks, so several runs can share a host. For DOMs
+    that can be given a urllib2 handler to fetch and store URIs with, the
+    same documents are served in-process by MemoryHandler, without a socket.
+    The classes for both are in domts.httpimitation, which is only imported
+    when one of them is first needed.
 """
 
-import threading, BaseHTTPServer
-__all__= ['imitate', 'PORT']
+import threading
+try:
+  from cStringIO import StringIO
+except ImportError:
+  from StringIO import StringIO
+__all__= ['imitate', 'getHandler', 'BodyStore', 'PORT', 'MEMORYHOST']
+
+# Port number to run the server on. 0 lets the system pick a free one.
+#
+PORT= 0
+
+# Host name in URIs served by MemoryHandler, which never goes near the network
+#
+MEMORYHOST= 'domts.imitation'
 
-# Arbitrary port number to run the server on
+# Bodies larger than SPOOL bytes are kept in temporary files rather than in
+# memory. Once more than LIMIT bytes are stored in all, the oldest bodies are
+# thrown away. Bodies are copied in and out CHUNK bytes at a time.
 #
-PORT= 9857
+SPOOL= 256*1024
+LIMIT= 64*1024*1024
+CHUNK= 64*1024
+
+def copy(source, destination, length= None):
+  """ Copy up to length bytes (or everything, if None) from one file to
+      another. Return the number of bytes copied.
+  """
+  copied= 0
+  while length is None or copied<length:
+    size= CHUNK
+    if length is not None:
+      size= min(size, length-copied)
+    chunk= source.read(size)
+    if chunk=='':
+      break
+    destination.write(chunk)
+    copied= copied+len(chunk)
+  return copied
+
+def spool():
+  import tempfile
+  try:
+    return tempfile.SpooledTemporaryFile(SPOOL)
+  except AttributeError:
+    return tempfile.TemporaryFile()
+
+class BodyStore:
+  """ Documents PUT to the imitation server, by path. Can be used as a
+      dictionary of strings, but put and write copy bodies from and to files
+      without holding them whole in memory.
+  """
+  def __init__(self, limit= LIMIT):
+    self.limit= limit
+    self.entries= {}
+    self.total= 0
+    self.tick= 0
+    self.lock= threading.Lock()
 
-memory= {}
+  def put(self, path, source, length= None):
+    """ Store a body read from a file, replacing any already at the path.
+    """
+    body= spool()
+    size= copy(source, body, length)
+    self.lock.acquire()
+    try:
+      self.discard(path)
+      self.tick= self.tick+1
+      self.entries[path]= [self.tick, body, size]
+      self.total= self.total+size
+      while self.total>self.limit and len(self.entries)>1:
+        oldest= None
+        for (key, entry) in self.entries.items():
+          if oldest is None or entry[0]<self.entries[oldest][0]:
+            oldest= key
+        self.discard(oldest)
+    finally:
+      self.lock.release()
+
+  def write(self, path, destination, start= None):
+    """ Copy the body at a path to a file, first calling start, if given,
+        with its length. Return false if there is none.
+    """
+    self.lock.acquire()
+    try:
+      entry= self.entries.get(path)
+      if entry is None:
+        return False
+      if start is not None:
+        start(entry[2])
+      entry[1].seek(0)
+      copy(entry[1], destination)
+      return True
+    finally:
+      self.lock.release()
+
+  def discard(self, path):
+    entry= self.entries.get(path)
+    if entry is not None:
+      del self.entries[path]
+      self.total= self.total-entry[2]
+      entry[1].close()
+
+  def clear(self):
+    self.lock.acquire()
+    try:
+      for path in self.entries.keys():
+        self.discard(path)
+    finally:
+      self.lock.release()
+
+  def has_key(self, path):
+    return self.entries.has_key(path)
+  def __len__(self):
+    return len(self.entries)
+  def __getitem__(self, path):
+    data= StringIO()
+    if not self.write(path, data):
+      raise KeyError(path)
+    return data.getvalue()
+  def __setitem__(self, path, data):
+    self.put(path, StringIO(data), len(data))
+  def __delitem__(self, path):
+    self.lock.acquire()
+    try:
+      if not self.entries.has_key(path):
+        raise KeyError(path)
+      self.discard(path)
+    finally:
+      self.lock.release()
+
+memory= BodyStore()
+
+server= None
+lock= threading.Lock()
 
 def imitate():
-  serve= BaseHTTPServer.HTTPServer(('', PORT), Imitation).serve_forever
-  imitation= threading.Thread(None, serve)
-  imitation.setDaemon(True)
-  imitation.start()
-
-class Imitation(BaseHTTPServer.BaseHTTPRequestHandler):
-  def do_GET(self):
-    if memory.has_key(self.path):
-      self.send_response(200)
-      self.send_header('Content-Type', 'text/xml')
-      self.end_headers()
-      self.wfile.write(memory[self.path])
-      self.wfile.close()
-    else:
-      self.send_error(404)
-  def do_PUT(self):
-    length= int(self.headers.getheader('Content-Length', '0'))
-    memory[self.path]= self.rfile.read(length)
-    self.send_response(200)
-    self.send_header('Content-Type', 'text/plain')
-    self.end_headers()
-    self.wfile.write('OK')
-    self.wfile.close()
-
-  def log_request(a= None, b= None):
-    pass
+  """ Start the imitation server in this process, if it isn't already
+      running. Return its 'host:port' address for use in URIs.
+  """
+  global server
+  lock.acquire()
+  try:
+    if server is None:
+      import BaseHTTPServer
+      from httpimitation import Imitation
+      server= BaseHTTPServer.HTTPServer(('', PORT), Imitation)
+      imitation= threading.Thread(None, server.serve_forever)
+      imitation.setDaemon(True)
+      imitation.start()
+    return 'localhost:%d' % server.server_address[1]
+  finally:
+    lock.release()
+
+handler= None
+
+def getHandler():
+  """ Return the shared MemoryHandler.
+  """
+  global handler
+  if handler is None:
+    from httpimitation import MemoryHandler
+    handler= MemoryHandler()
+  return handler
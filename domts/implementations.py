@@ -1,11 +1,16 @@
 """ domts.implementations: interfacing to testable DOM implementations
 """
 
-__all__= ['IMPLEMENTATIONS']
+__all__= ['IMPLEMENTATIONS', 'registerImplementation']
 
-import os, urllib
+import os, sys
 try: True
 except NameError: globals()['True'],globals()['False']= not None, not not None
+
+def fileURI(path):
+  import urllib
+  return 'file:'+urllib.pathname2url(path)
+
 def dictadd(a, b):
   ab= a.copy()
   ab.update(b)
@@ -22,6 +27,12 @@ class Implementation:
       - add more implementation attributes to fixedAttributes
       - provide _get/_setImplementationAttribute for non-fixed attributes
       - put attribute-initialising code in beginTest
+      - provide attributeState if non-fixed attributes affect parsing
+      - override copyDocument if there is a better way to copy documents
+      - override identity if the DOM's code is not all in one module
+      - provide useURLHandler if the DOM can fetch and store URIs through
+        a given urllib2 handler
+      - provide releaseDocument if documents need help being freed
   """
   extension= '.xml'
   contentType= 'text/xml'
@@ -50,6 +61,53 @@ class Implementation:
       'implementationAttribute %s cannot be set to %s' % (attr, str(value))
     )
 
+  def attributeState(self):
+    """ Return a hashable summary of the current settings of the attributes
+        that are not fixed, so that parsed documents can be cached per
+        configuration.
+    """
+    return ()
+  def copyDocument(self, document):
+    """ Return a new, independent copy of a Document returned by parseFile,
+        or None if parsing the file again would be better.
+    """
+    try:
+      return document.cloneNode(True)
+    except Exception:
+      return None
+  def useURLHandler(self, handler):
+    """ Make the DOM use a urllib2 handler for http URIs it reads from or
+        writes to (eg. by installing an opener with it, or giving it to the
+        DOM's resource resolver). Return true if it will; otherwise the tests
+        need a real web server.
+    """
+    return False
+  def releaseDocument(self, document):
+    """ Free a Document a test has finished with, eg. by breaking reference
+        cycles that would otherwise leave it to the garbage collector.
+    """
+    pass
+  def identity(self):
+    """ Return a string identifying the code under test, so that stored
+        results are only reused for the same version of the same DOM. By
+        default this uses the version and file content of the module holding
+        the implementation (or the module property, if there is one).
+    """
+    from store import fileDigest
+    module= getattr(self, 'module', None)
+    if module is None:
+      module= sys.modules.get(self.implementation.__class__.__module__)
+    parts= [self.implementationName]
+    if module is not None:
+      if hasattr(module, '__version__'):
+        parts.append(str(module.__version__))
+      path= getattr(module, '__file__', None)
+      if path is not None:
+        if path[-4:] in ('.pyc', '.pyo') and os.path.exists(path[:-1]):
+          path= path[:-1]
+        parts.append(str(fileDigest(path)))
+    return ' '.join(parts)
+
   # General immutable attributes. Python has a null type (None) and uses
   # signed numbers so these shouldn't be changed. I have no idea what
   # 'coalescing' is supposed to do, but it always seems to be set false.
@@ -77,7 +135,7 @@ class Level3LSImplementation(Implementation):
     self.parser.domConfig.setParameter('entities', False)
 
   def parseFile(self, path):
-    return self.parser.parseURI('file:'+urllib.pathname2url(path))
+    return self.parser.parseURI(fileURI(path))
 
   def _getImplementationAttribute(self, attr):
     if not self.attributeParameters.has_key(attr):
@@ -88,6 +146,15 @@ class Level3LSImplementation(Implementation):
       return not value
     return value
 
+  def attributeState(self):
+    state= []
+    params= self.attributeParameters.values()
+    params.sort()
+    for (param, flag) in params:
+      if param is not None:
+        state.append((param, self.parser.domConfig.getParameter(param)))
+    return tuple(state)
+
   def _setImplementationAttribute(self, attr, value):
     if not self.attributeParameters.has_key(attr):
       raise NotImplementedError('Unknown implementationAttribute %s' % attr)
@@ -150,6 +217,15 @@ class MinidomImplementation(Implementation):
     os.chdir(os.path.dirname(path))
     return self.module.parse(path)
 
+  def releaseDocument(self, document):
+    document.unlink()
+
+  def copyDocument(self, document):
+    # minidom's parser is faster than its cloneNode, which also loses some of
+    # the doctype.
+    #
+    return None
+
   fixedAttributes= dictadd(Implementation.fixedAttributes, {
     'namespaceAware': True,
     'validating': False,
@@ -184,7 +260,10 @@ class FourDOMImplementation(Implementation):
       self.parser.unparsedEntityDecl= doNothing
 
   def parseFile(self, path):
-    return self.parser.fromUri('file:'+urllib.pathname2url(path))
+    return self.parser.fromUri(fileURI(path))
+
+  def releaseDocument(self, document):
+    self.parser.releaseNode(document)
 
   fixedAttributes= dictadd(Implementation.fixedAttributes, {
     'namespaceAware': True,
@@ -208,7 +287,7 @@ class DomletteImplementation(Implementation):
     self.factory = InputSource.DefaultFactory
 
   def parseFile(self, path):
-    source= self.factory.fromUri('file:'+urllib.pathname2url(path))
+    source= self.factory.fromUri(fileURI(path))
     return self.parser(source)
 
   fixedAttributes= dictadd(Implementation.fixedAttributes, {
@@ -263,10 +342,79 @@ class MicrodomImplementation(Implementation):
   })
 
 
-# Make a map of all the Implementation classes defined in this module, indexed
-# by their names.
+# The map of implementation names (in lower case) to the Implementation
+# classes for them. Classes are given by module and class name and only
+# imported when first asked for, so other packages can add implementations
+# without domts importing them up front. They can do that by calling
+# registerImplementation, or by declaring a setuptools entry point in the
+# ENTRYPOINTS group, named after the implementation and pointing at the
+# class; those are only looked at when a name isn't otherwise known.
 #
-IMPLEMENTATIONS= {}
-for x in globals().values():
-  if hasattr(x, 'implementationName'):
-    IMPLEMENTATIONS[x.implementationName.lower()]= x
+ENTRYPOINTS= 'domts.implementations'
+
+class Registry:
+  def __init__(self):
+    self.names= {}
+    self.classes= {}
+    self.scanned= False
+
+  def register(self, name, module, className):
+    self.names[name.lower()]= (module, className)
+    if self.classes.has_key(name.lower()):
+      del self.classes[name.lower()]
+
+  def scan(self):
+    """ Add implementations declared as entry points, once.
+    """
+    if self.scanned:
+      return
+    self.scanned= True
+    try:
+      import pkg_resources
+    except ImportError:
+      return
+    for entry in pkg_resources.iter_entry_points(ENTRYPOINTS):
+      if not self.names.has_key(entry.name.lower()):
+        self.register(entry.name, entry.module_name, '.'.join(entry.attrs))
+
+  def __getitem__(self, name):
+    name= name.lower()
+    if not self.classes.has_key(name):
+      if not self.names.has_key(name):
+        self.scan()
+      (module, className)= self.names[name]
+      x= __import__(module, globals(), locals(), [className])
+      for attr in className.split('.'):
+        x= getattr(x, attr)
+      self.classes[name]= x
+    return self.classes[name]
+
+  def has_key(self, name):
+    if not self.names.has_key(name.lower()):
+      self.scan()
+    return self.names.has_key(name.lower())
+  def get(self, name, default= None):
+    if not self.has_key(name):
+      return default
+    return self[name]
+  def keys(self):
+    self.scan()
+    return self.names.keys()
+
+IMPLEMENTATIONS= Registry()
+for (name, className) in [
+  ('minidom', 'MinidomImplementation'),
+  ('4DOM', 'FourDOMImplementation'),
+  ('pxdom', 'PxdomImplementation'),
+  ('cDomlette', 'CDomletteImplementation'),
+  ('FtMiniDom', 'FtMiniDomImplementation'),
+  ('microdom', 'MicrodomImplementation')
+]:
+  IMPLEMENTATIONS.register(name, __name__, className)
+
+def registerImplementation(name, module, className):
+  """ Make an Implementation class available under a name, eg. for the
+      --testdom option. It is imported from the module the first time the
+      name is used.
+  """
+  IMPLEMENTATIONS.register(name, module, className)
@@ -12,6 +12,8 @@ import operator
 from UserList import UserList
 try: True
 except NameError: globals()['True'],globals()['False']= not None, not not None
+try: frozenset
+except NameError: from sets import ImmutableSet as frozenset
 
 
 # Simple comparators for CONDITIONS map
@@ -74,14 +76,14 @@ CONDITIONS= {
 ACTUALS= ['actual', 'obj', 'collection']
 EXPECTEDS= ['expected','size','file','value','type','str','name','severity']
 
-ASSERTS= []
-for condition, comparer in CONDITIONS.items():
-  ASSERTS.append('assert'+condition[0].upper()+condition[1:])
+ASSERTS= frozenset([
+  'assert'+condition[0].upper()+condition[1:] for condition in CONDITIONS.keys()
+])
 
-EXCEPTIONASSERTS= [
+EXCEPTIONASSERTS= frozenset([
   'assertDOMException', 'assertLSException',
   'assertXPathException', 'assertImplementationException'
-]
+])
 
 UNARYOPS= {
   'increment': operator.add,
@@ -103,12 +105,15 @@ CONDITIONOPS= {
 
 # Elements to ignore when encountered in statement context
 #
-IGNORE= ['comment', 'metadata', 'else']
+IGNORE= frozenset(['comment', 'metadata', 'else'])
 
 
 class OrderedList(UserList):
-  """ List that can be recursively lowercased for comparison purposes.
+  """ List that can be recursively lowercased for comparison purposes. The
+      lowercased version is a view sharing the original's members, which
+      are only lowercased one at a time as they are compared.
   """
+  folded= False
   def __init__(self, data= None):
     if isinstance(data, UserList):
       self.data= data.data
@@ -117,32 +122,67 @@ class OrderedList(UserList):
     else:
       self.data= []
   def lower(self):
-    lower= self.__class__()
-    for datum in self.data:
-      lower.append(datum.lower())
+    lower= self.__class__(self.data)
+    lower.folded= True
     return lower
+  def members(self):
+    """ Iterate over the members as they should be compared.
+    """
+    if self.folded:
+      return (datum.lower() for datum in self.data)
+    return iter(self.data)
+
+  def __eq__(self, other):
+    if not isinstance(other, OrderedList):
+      if self.folded:
+        return list(self.members())==other
+      return self.data==other
+    if len(other)!=len(self):
+      return False
+    others= other.members()
+    for datum in self.members():
+      if datum!=others.next():
+        return False
+    return True
+  def __ne__(self, other):
+    return not self.__eq__(other)
 
 class UnorderedList(OrderedList):
   """ List used for non-ordered Collection objects. When being compared, the
-      order of members is irrelevant. This should ideally be a Python Set, but
-      we don't need the can-only-contain-one-identical-item restriction in any
-      of the current tests, and don't want to require Python 2.3.
+      order of members is irrelevant, but the number of times each appears is
+      not. Members are counted by hash; any that can't be hashed are matched
+      up one by one instead.
   """
   def __cmp__(self, other):
     if not isinstance(other, OrderedList):
       return 1
     if len(other)!=len(self):
       return 1
-    for datum in self.data:
-      if not datum in other:
+    counts= {}
+    unhashable= []
+    for datum in self.members():
+      try:
+        counts[datum]= counts.get(datum, 0)+1
+      except TypeError:
+        unhashable.append(datum)
+    for datum in other.members():
+      try:
+        count= counts.get(datum, 0)
+      except TypeError:
+        try:
+          unhashable.remove(datum)
+        except ValueError:
+          return 1
+        continue
+      if count==0:
         return 1
+      counts[datum]= count-1
     return 0
   def __eq__(self, other):
     return self.__cmp__(other)==0
   def __ne__(self, other):
     return self.__cmp__(other)!=0
 
-
 OBJECTS={
   'Collection': UnorderedList,
   'List':       OrderedList
@@ -3,10 +3,14 @@
 """
 
 __all__= [
-  'PROPERTIES', 'EXCEPTIONS', 'METHODS', 'COMPLEXOBJECTS', 'SIMPLEOBJECTS'
+  'PROPERTIES', 'EXCEPTIONS', 'EXCEPTIONCODES', 'METHODS', 'QUERIES',
+  'COMPLEXOBJECTS', 'SIMPLEOBJECTS'
 ]
 
+import binascii
 from inbuilts import OBJECTS, TestCreatedObject
+try: frozenset
+except NameError: from sets import ImmutableSet as frozenset
 def dictadd(a, b):
   ab= a.copy()
   ab.update(b)
@@ -14,7 +18,7 @@ def dictadd(a, b):
 
 # All get/settable DOM properties.
 #
-PROPERTIES= [
+PROPERTIES= frozenset([
   # level1/core
   'nodeType', 'nodeValue', 'nodeName', 'ownerDocument', 'firstChild',
   'lastChild', 'nextSibling', 'previousSibling', 'parentNode', 'childNodes',
@@ -69,7 +73,7 @@ PROPERTIES= [
   # TS-specific properties
   'allErrors', 'allEvents', 'atEvents', 'bubbledEvents', 'capturedEvents',
   'allNotifications', 'operation', 'key', 'dst', 'errors',
-]
+])
 
 # DOMException types, in order.
 #
@@ -88,6 +92,12 @@ EXCEPTIONS= EXCEPTIONS+['*']*(81-len(EXCEPTIONS))+ [
   'PARSE_ERR', 'SERIALIZE_ERR'
 ]
 
+# Map of exception names to their codes, for the named entries in EXCEPTIONS.
+#
+EXCEPTIONCODES= {}
+for code in range(len(EXCEPTIONS)-1, -1, -1):
+  EXCEPTIONCODES[EXCEPTIONS[code]]= code
+
 # DOM methods and the correct order for their arguments.
 #
 METHODS= {
@@ -271,27 +281,63 @@ METHODS= {
 }
 
 
+# DOM methods that only look at a document and never change one.
+#
+QUERIES= frozenset([
+  'hasChildNodes', 'hasFeature', 'getAttribute', 'hasAttribute',
+  'getAttributeNode', 'getElementsByTagName', 'item', 'getNamedItem',
+  'substringData', 'namedItem', 'getElementsByName', 'getElementsByTagNameNS',
+  'getNamedItemNS', 'getAttributeNS', 'getAttributeNodeNS', 'hasAttributeNS',
+  'getElementById', 'hasAttributes', 'isSupported', 'getFeature',
+  'compareDocumentPosition', 'isSameNode', 'isEqualNode',
+  'lookupNamespaceURI', 'lookupPrefix', 'isDefaultNamespace', 'getUserData',
+  'getDOMImplementation', 'getDOMImplementationList', 'getParameter',
+  'canSetParameter', 'contains', 'isDerivedFrom'
+])
+
 class LSCharacterStream:
+  """ Stream for LSInput and LSOutput's characterStream. Writes are kept as a
+      list of chunks, only joined when read; reads of a given size take the
+      next part of the joined value from an offset into it.
+  """
   def __init__(self, value):
-    if value is None:
-      self.value= ''
+    self.chunks= []
+    self.offset= 0
+    if value is not None:
+      self.chunks.append(self.decode(value))
+  def decode(self, value):
+    return value
+
+  def join(self):
+    if len(self.chunks)!=1:
+      self.chunks= [''.join(self.chunks)]
+    return self.chunks[0]
+  def getvalue(self):
+    """ Return everything written to the stream and not yet read.
+    """
+    return self.join()[self.offset:]
+
+  def read(self, size= -1):
+    data= self.join()
+    if size is None or size<0 or self.offset+size>=len(data):
+      chunk= data[self.offset:]
+      self.chunks= []
+      self.offset= 0
     else:
-      self.value= value
-  def read(self):
-    try:
-      return self.value
-    finally:
-      self.value= ''
+      chunk= data[self.offset:self.offset+size]
+      self.offset= self.offset+size
+    return chunk
   def write(self, chars):
-    self.value= self.value+chars
+    self.chunks.append(chars)
 
 class LSByteStream(LSCharacterStream):
-  def __init__(self, value):
-    bytes= []
-    if value is not None:
-      for ix in range(0, len(value), 2):
-        bytes.append(chr(eval('0x'+value[ix:ix+2])))
-    self.value= ''.join(bytes)
+  """ Stream for LSInput and LSOutput's byteStream, initialised from a string
+      of hex digits.
+  """
+  def decode(self, value):
+    if len(value)%2!=0:
+      value= value[:-1]+'0'+value[-1]
+    return binascii.unhexlify(value)
 
 # Simple objects initialised from TSML <var value> attrs
 #
@@ -1,13 +1,13 @@
 """ domts.interpreter: main TSML test runner
 """
 
-__all__= ['Tester']
+__all__= ['Tester', 'STATEMENTS', 'registerStatement']
 
-import os, sys, urllib, tempfile, random
+import os, sys
 from inbuilts import *
 from interfaces import *
 from interrupter import *
-from imitation import PORT
+from expressions import EXPRESSIONS
 
 try: True
 except NameError: globals()['True'],globals()['False']= not None, not not None
@@ -30,6 +30,8 @@ class TestException(Exception):
     return '%s: %s, %s' % (Exception.__str__(self),
       self.exception.__class__.__name__, str(self.exception)
     )
+  def __reduce__(self):
+    return (self.__class__, (Exception.__str__(self), self.exception))
 
 class ReturnValue(Exception):
   """ A test-created method used a <return> element. Must be caught by a
@@ -41,19 +43,56 @@ class ReturnValue(Exception):
 
 
 class Tester:
-  def __init__(self, implementation, filesPath):
+  """ Runs TSML tests against an implementation. Each test document is first
+      compiled into a tree of Python callables, with element names, attribute
+      values and argument lists resolved once, and then executed. Tests are
+      given as domts.tsml Documents, whose elements carry a tuple of their
+      child elements for the compilers to use.
+  """
+  def __init__(self, implementation, filesPath, expressions= None,
+    cacheFixtures= False, profiler= None, tempRoot= None, iteration= 'auto'
+  ):
     self.implementation= implementation
     self.filesPath= filesPath
+    if tempRoot is None:
+      tempRoot= defaultTempRoot()
+    self.tempRoot= tempRoot
+    self.tempDir= None
+    self.profiler= profiler
+    self.fixtures= None
+    if cacheFixtures:
+      self.fixtures= {}
+    self.sharedFixtures= {}
+    if expressions is None:
+      expressions= EXPRESSIONS
+    self.expressions= expressions
+    self.watchdog= getWatchdog()
+    self.host= None
+    if iteration not in ITERATIONS:
+      raise ValueError('Unknown iteration mode %s' % iteration)
+    self.iteration= iteration
+    self.iterations= {'stream': 0, 'snapshot': 0}
+    self.loaded= []
     self.scope= CONSTANTS.copy()
     self.globalScope= None
 
   def runTest(self, testDoc):
-    self.tempFiles= []
     testRoot= testDoc.documentElement
-    testName= testRoot.getAttribute('name')
+    return self.runCompiled(
+      testRoot.getAttribute('name'), self.compile(testRoot.childNodes)
+    )
+
+  def runCompiled(self, testName, program):
+    """ Run a test that has already been compiled. Return a (testName,
+        passedFlag, skippedFlag, failInfo) tuple.
+    """
+    self.tempDir= None
+    self.sharedFixtures= {}
+    self.loaded= []
+    self.scope= CONSTANTS.copy()
     try:
       try:
-        self.process(testRoot.childNodes)
+        self.execute(program)
       except NotImplementedError, e:
         return (testName, False, True, e)
       except (AssertionError, TestException), e:
@@ -63,158 +102,294 @@ class Tester:
           raise
       return (testName, True, False, None)
     finally:
-      for path in self.tempFiles:
+      self.tearDown()
+
+  def tearDown(self):
+    """ Drop everything a test left behind, so nothing it made stays
+        reachable into the next test: its variables, by starting a fresh
+        scope; the documents it loaded or kept in variables, by giving them
+        to the implementation to release (apart from cached fixtures, which
+        later tests use again); and its temporary files.
+    """
+    scope= self.scope
+    self.scope= CONSTANTS.copy()
+    kept= {}
+    if self.fixtures is not None:
+      for document in self.fixtures.values():
+        kept[id(document)]= True
+    for document in self.loaded+scope.values():
+      if not kept.has_key(id(document)) and isDocument(document):
+        kept[id(document)]= True
         try:
-          os.remove(path)
-        except OSError:
+          self.implementation.releaseDocument(document)
+        except NonErrors:
+          raise
+        except Exception:
           pass
+    self.loaded= []
+    self.sharedFixtures= {}
+    if self.tempDir is not None:
+      import shutil
+      shutil.rmtree(self.tempDir, True)
+      self.tempDir= None
 
 
   def process(self, children):
     """ Execute a list of TSML command nodes.
     """
+    self.execute(self.compile(children))
+
+  def execute(self, statements):
+    """ Execute a compiled block, as returned by compile.
+    """
+    for statement in statements:
+      statement()
+
+  def compile(self, children):
+    """ Compile a list of TSML command nodes into a block: a tuple of
+        argumentless callables, one per statement, to be run in order.
+    """
+    statements= []
     for child in children:
       if child.nodeType!=child.ELEMENT_NODE:
         continue
-      t= child.tagName
+      statement= self.compileStatement(child)
+      if statement is not None:
+        statements.append(statement)
+    return tuple(statements)
 
-      # Special case - hasFeature can be a method call, or an implementation
-      # check if no object is passed
-      #
-      if t=='hasFeature' and not child.hasAttribute('obj'):
-        feature= self.ueval(child.getAttribute('feature'))
-        version= self.ueval(child.getAttribute('version') or 'null')
-        try:
-          hasFeature= self.implementation.implementation.hasFeature(
-            feature,version
-          )
-        except NonErrors:
-          raise
-        except Exception:
-          hasFeature= False
-        if not hasFeature:
-          raise NotImplementedError('Feature %s %s' % (feature, version))
 
-      # Deal with other elements
-      #
-      elif t in IGNORE:
-        pass
-      elif METHODS.has_key(t):
-        self.callMethod(child)
-      elif t=='implementation' and not child.hasAttribute('obj'):
-        # special case, implementation can be got without using obj property
-        varName= child.getAttribute('var')
-        self.scope[varName]= self.implementation.implementation
-      elif t in PROPERTIES:
-        if child.hasAttribute('value'):
-          self.setProperty(child)
-        else:
-          self.getProperty(child)
-      elif t in ASSERTS:
-        self.makeAssertion(child)
-      elif t in EXCEPTIONASSERTS:
-        self.exceptionAssertion(child)
-      elif UNARYOPS.has_key(t):
-        varName= child.getAttribute('var')
-        value= self.ueval(child.getAttribute('value'))
-        self.scope[varName]= UNARYOPS[t](self.scope[varName], value)
-      elif BINARYOPS.has_key(t):
-        op1= self.ueval(child.getAttribute('op1'))
-        op2= self.ueval(child.getAttribute('op2'))
-        self.scope[child.getAttribute('var')]= BINARYOPS[t](op1, op2)
-      elif t=='assign':
-        varName= child.getAttribute('var')
-        self.scope[varName]= self.ueval(child.getAttribute('value'))
-      elif t=='append':
-        varName= child.getAttribute('collection')
-        if child.hasAttribute('item'):
-          member= self.ueval(child.getAttribute('item'))
-        else:
-          member= self.scope[child.getAttribute('obj')]
+  def timed(self, kind, name, call):
+    """ Return a callable to use in place of call in a compiled statement.
+        If the Tester has a profiler, this is the profiler's timed wrapper,
+        recording the kind of call ('method', 'get', 'set' or 'load') and the
+        DOM member or file name, or 'element' and the tag name for a whole
+        compiled statement. Otherwise it is call itself, so there is no cost
+        when not profiling.
+    """
+    if self.profiler is None:
+      return call
+    return self.profiler.timed(kind, name, call)
+
+  def compileStatement(self, child):
+    """ Compile a single TSML command element by looking up its compiler in
+        the STATEMENTS table. Return a callable that carries out the command,
+        or None if the element has no effect. Problems in the test description
+        are reported when the statement is executed, not when it is compiled,
+        so that a test fails at the same point it would if it were being
+        interpreted directly.
+    """
+    compiler= STATEMENTS.get(child.tagName)
+    if compiler is None:
+      return raiser(NotImplementedError('Unknown TSML element %s' % child.tagName))
+    statement= compiler(self, child)
+    if statement is not None and self.profiler is not None:
+      statement= self.timed('element', child.tagName, statement)
+    return statement
+
+
+  def compileIgnored(self, testNode):
+    return None
+
+  def compileHasFeature(self, testNode):
+    # Special case - hasFeature can be a method call, or an implementation
+    # check if no object is passed
+    #
+    if testNode.hasAttribute('obj'):
+      return self.compileMethod(testNode)
+    featureExpr= testNode.getAttribute('feature')
+    versionExpr= testNode.getAttribute('version') or 'null'
+    def statement():
+      self.checkFeature(self.ueval(featureExpr), self.ueval(versionExpr))
+    return statement
+
+  def checkFeature(self, feature, version):
+    """ Raise NotImplementedError if the implementation does not have a
+        feature.
+    """
+    try:
+      hasFeature= self.implementation.implementation.hasFeature(
+        feature,version
+      )
+    except NonErrors:
+      raise
+    except Exception:
+      hasFeature= False
+    if not hasFeature:
+      raise NotImplementedError('Feature %s %s' % (feature, version))
+
+  def compileImplementation(self, testNode):
+    # special case, implementation can be got without using obj property
+    #
+    if testNode.hasAttribute('obj'):
+      return self.compileProperty(testNode)
+    varName= testNode.getAttribute('var')
+    def statement():
+      self.scope[varName]= self.implementation.implementation
+    return statement
+
+  def compileProperty(self, testNode):
+    if testNode.hasAttribute('value'):
+      return self.compileSetProperty(testNode)
+    return self.compileGetProperty(testNode)
+
+  def compileUnaryOp(self, testNode):
+    varName= testNode.getAttribute('var')
+    valueExpr= testNode.getAttribute('value')
+    op= UNARYOPS[testNode.tagName]
+    def statement():
+      value= self.ueval(valueExpr)
+      self.scope[varName]= op(self.scope[varName], value)
+    return statement
+
+  def compileBinaryOp(self, testNode):
+    varName= testNode.getAttribute('var')
+    op1Expr= testNode.getAttribute('op1')
+    op2Expr= testNode.getAttribute('op2')
+    op= BINARYOPS[testNode.tagName]
+    def statement():
+      op1= self.ueval(op1Expr)
+      op2= self.ueval(op2Expr)
+      self.scope[varName]= op(op1, op2)
+    return statement
+
+  def compileAssign(self, testNode):
+    varName= testNode.getAttribute('var')
+    valueExpr= testNode.getAttribute('value')
+    def statement():
+      self.scope[varName]= self.ueval(valueExpr)
+    return statement
+
+  def compileAppend(self, testNode):
+    varName= testNode.getAttribute('collection')
+    if testNode.hasAttribute('item'):
+      itemExpr= testNode.getAttribute('item')
+      def statement():
+        member= self.ueval(itemExpr)
         self.scope[varName].append(member)
-      elif t=='substring':
-        ix0= self.ueval(child.getAttribute('beginIndex'))
-        ix1= self.ueval(child.getAttribute('endIndex'))
-        substr= self.scope[child.getAttribute('obj')][ix0:ix1]
-        self.scope[child.getAttribute('var')]= substr
-      elif t=='for-each':
-        self.forLoop(child)
-      elif t=='while':
-        self.whileLoop(child)
-      elif t=='if':
-        self.ifCondition(child)
-      elif t=='try':
-        self.tryBlock(child)
-      elif t=='fail':
-        name= child.getAttribute('id')
-        raise AssertionError('Assertion %s failed, no exception' % name)
-      elif t=='return':
-        if child.hasAttribute('value'):
-          raise ReturnValue(self.ueval(child.getAttribute('value')))
-        raise ReturnValue(None)
-      elif t=='var':
-        (varName, initialValue)= self.readVar(child)
-        self.scope[varName]= initialValue
-      elif t=='implementationAttribute':
-        attr= child.getAttribute('name')
-        value= self.ueval(child.getAttribute('value'))
-        self.implementation.setImplementationAttribute(attr, value)
-      elif t in ('load', 'getResourceURI'):
-        varName= child.getAttribute('var')
-        ext= self.implementation.extension
-        href= child.getAttribute('href')
-        if t=='getResourceURI':
-          href= self.ueval(href)
-        if href=='testpdf':
-          ext= '.pdf'
-        filePath= os.path.join(self.filesPath, href+ext)
-        if t=='getResourceURI':
-          self.scope[varName]= 'file:'+urllib.pathname2url(filePath)
-        else:
-          try:
-            self.scope[varName]= self.implementation.parseFile(filePath)
-          except NonErrors:
-            raise
-          except Exception, e:
-            raise TestException('Document load failed', e)
-      elif t=='createTempURI':
-        scheme= child.getAttribute('scheme')
-        if scheme=='file':
-          filePath= tempfile.mktemp()
-          self.tempFiles.append(filePath)
-          varName= child.getAttribute('var')
-          self.scope[varName]= 'file:'+urllib.pathname2url(filePath)
-        elif scheme=='http':
-          uri= 'http://localhost:%d/%d.xml' % (PORT,int(random.random()*1000))
-          self.scope[child.getAttribute('var')]= uri
-        else:
-          raise NotImplementedError('Unknown scheme '+scheme)
-      elif t=='createXPathEvaluator':
-        self.scope[child.getAttribute('var')]= (
-          self.ueval(child.getAttribute('document'))
-        )
-      elif t=='debug':
-        print self.ueval(child.getAttribute('out'))
-      elif t=='DOMImplementationRegistry.newInstance':
-        raise NotImplementedError('DOMImplementationRegistry is not bound in Python')
+    else:
+      objName= testNode.getAttribute('obj')
+      def statement():
+        member= self.scope[objName]
+        self.scope[varName].append(member)
+    return statement
+
+  def compileSubstring(self, testNode):
+    varName= testNode.getAttribute('var')
+    objName= testNode.getAttribute('obj')
+    beginExpr= testNode.getAttribute('beginIndex')
+    endExpr= testNode.getAttribute('endIndex')
+    def statement():
+      ix0= self.ueval(beginExpr)
+      ix1= self.ueval(endExpr)
+      self.scope[varName]= self.scope[objName][ix0:ix1]
+    return statement
+
+  def compileFail(self, testNode):
+    return raiser(AssertionError(
+      'Assertion %s failed, no exception' % testNode.getAttribute('id')
+    ))
+
+  def compileReturn(self, testNode):
+    if testNode.hasAttribute('value'):
+      valueExpr= testNode.getAttribute('value')
+      def statement():
+        raise ReturnValue(self.ueval(valueExpr))
+      return statement
+    def statement():
+      raise ReturnValue(None)
+    return statement
+
+  def compileVarStatement(self, testNode):
+    (varName, initialiser)= self.compileVar(testNode)
+    def statement():
+      self.scope[varName]= initialiser()
+    return statement
+
+  def compileImplementationAttribute(self, testNode):
+    attr= testNode.getAttribute('name')
+    valueExpr= testNode.getAttribute('value')
+    def statement():
+      value= self.ueval(valueExpr)
+      self.implementation.setImplementationAttribute(attr, value)
+    return statement
+
+  def compileCreateTempURI(self, testNode):
+    varName= testNode.getAttribute('var')
+    scheme= testNode.getAttribute('scheme')
+    if scheme=='file':
+      import tempfile
+      def statement():
+        if self.tempDir is None:
+          if not os.path.isdir(self.tempRoot):
+            os.makedirs(self.tempRoot)
+          self.tempDir= tempfile.mkdtemp('', 'domts-%d-' % os.getpid(),
+            self.tempRoot
+          )
+        filePath= tempfile.mktemp('.xml', '', self.tempDir)
+        self.scope[varName]= fileURI(filePath)
+    elif scheme=='http':
+      import random
+      def statement():
+        uri= 'http://%s/%d.xml' % (self.imitationHost(),int(random.random()*1000))
+        self.scope[varName]= uri
+    else:
+      return raiser(NotImplementedError('Unknown scheme '+scheme))
+    return statement
+
+  def removeTempDirs(self, pid):
+    """ Remove temporary directories left behind by a process that was
+        killed before it could clean up after its test.
+    """
+    import glob, shutil
+    for path in glob.glob(os.path.join(self.tempRoot, 'domts-%d-*' % pid)):
+      shutil.rmtree(path, True)
+
+  def imitationHost(self):
+    """ Return the host part of http URIs for tests to store documents at.
+        The first time, offer the implementation the in-process handler, and
+        if it won't take it, start the imitation server.
+    """
+    if self.host is None:
+      from imitation import imitate, getHandler, MEMORYHOST
+      if self.implementation.useURLHandler(getHandler()):
+        self.host= MEMORYHOST
       else:
-        raise NotImplementedError('Unknown TSML element %s' % t)
+        self.host= imitate()
+    return self.host
+
+  def compileCreateXPathEvaluator(self, testNode):
+    varName= testNode.getAttribute('var')
+    documentExpr= testNode.getAttribute('document')
+    def statement():
+      self.scope[varName]= self.ueval(documentExpr)
+    return statement
+
+  def compileDebug(self, testNode):
+    outExpr= testNode.getAttribute('out')
+    def statement():
+      print self.ueval(outExpr)
+    return statement
 
+  def compileRegistry(self, testNode):
+    return raiser(NotImplementedError(
+      'DOMImplementationRegistry is not bound in Python'
+    ))
 
-  def callMethod(self, testNode):
+
+  def compileMethod(self, testNode):
     methodName= testNode.tagName
-    obj= self.ueval(testNode.getAttribute('obj'))
-    if not hasattr(obj, testNode.tagName):
-      try:
-        strobj= str(obj)
-      except Exception, e:
-        strobj= '(unprintable object)'
-      raise TestException('Missing method %s on %s' % (
-        methodName, strobj), AttributeError()
-      )
-    method= getattr(obj, methodName)
-    arguments= []
-    for par in METHODS[testNode.tagName]:
+    objExpr= testNode.getAttribute('obj')
+    varName= None
+    if testNode.hasAttribute('var'):
+      varName= testNode.getAttribute('var')
+
+    # Work out the argument expressions now; None stands for an omitted
+    # optional argument that must be passed as None.
+    #
+    argExprs= []
+    argError= None
+    for par in METHODS[methodName]:
       # special case, acceptNode has different arg names depending on its
       # object.
       if not testNode.hasAttribute(par):
@@ -223,62 +398,44 @@ class Tester:
       if not testNode.hasAttribute(par):
         # special case, hasFeature can omit version arg
         if par=='version':
-          arguments.append(None)
+          argExprs.append(None)
         elif methodName=='evaluate':
           # special case, there are two 'evaluate' methods on
           # different objects. One omits a couple of arguments.
           pass
         else:
-          raise ValueError('TSML argument attribute %s missing' % par)
+          argError= ValueError('TSML argument attribute %s missing' % par)
+          break
       else:
-        arguments.append(self.ueval(testNode.getAttribute(par)))
-    interrupter= Interrupter()
-    try:
-      interrupter.start()
-      try:
-        value= apply(method, arguments)
-      finally:
-        interrupter.finish()
-    except NonErrors:
-      raise
-    except (TestException, AssertionError, ReturnValue):
-      raise
-    except Exception, e:
-      try:
-        strobj= str(obj)
-      except Exception, e:
-        strobj= '(unprintable object)'
-      raise TestException('Calling %s on %s' % (methodName, strobj), e)
-    if testNode.hasAttribute('var'):
-      self.scope[testNode.getAttribute('var')]= value
-
-
-  def getProperty(self, testNode):
-    obj= self.ueval(testNode.getAttribute('obj'))
-    propName= testNode.tagName
-
-    # Python binds DOMString to native strings (either type). These have no
-    # 'length' property as required by some tests, so simulate this.
-    #
-    if propName=='length' and type(obj) in (type(''), type(u'')):
-      value= len(obj)
-    else:
+        argExprs.append(testNode.getAttribute(par))
 
-      # Try to read property
-      #
-      interrupter= Interrupter()
-      try:
-        interrupter.start()
-        try:
-          value= getattr(obj, propName)
-        finally:
-          interrupter.finish()
-      except AttributeError, e:
+    watchdog= self.watchdog
+    invoke= self.timed('method', methodName, apply)
+    def statement():
+      obj= self.ueval(objExpr)
+      if not hasattr(obj, methodName):
         try:
           strobj= str(obj)
         except Exception, e:
           strobj= '(unprintable object)'
-        raise TestException('Missing property %s on %s'%(propName,strobj),e)
+        raise TestException('Missing method %s on %s' % (
+          methodName, strobj), AttributeError()
+        )
+      method= getattr(obj, methodName)
+      if argError is not None:
+        raise argError
+      arguments= []
+      for argExpr in argExprs:
+        if argExpr is None:
+          arguments.append(None)
+        else:
+          arguments.append(self.ueval(argExpr))
+      try:
+        token= watchdog.arm()
+        try:
+          value= invoke(method, arguments)
+        finally:
+          watchdog.disarm(token)
       except NonErrors:
         raise
       except (TestException, AssertionError, ReturnValue):
@@ -288,313 +445,708 @@ class Tester:
           strobj= str(obj)
         except Exception, e:
           strobj= '(unprintable object)'
-        raise TestException('Getting %s on %s' % (propName,strobj), e)
+        raise TestException('Calling %s on %s' % (methodName, strobj), e)
+      if varName is not None:
+        self.scope[varName]= value
+    return statement
 
-    # Write to variable
-    #
+
+  def compileGetProperty(self, testNode):
+    propName= testNode.tagName
+    objExpr= testNode.getAttribute('obj')
+    varName= None
     if testNode.hasAttribute('var'):
-      self.scope[testNode.getAttribute('var')]= value
+      varName= testNode.getAttribute('var')
+
+    watchdog= self.watchdog
+    get= self.timed('get', propName, getattr)
+    def statement():
+      obj= self.ueval(objExpr)
+
+      # Python binds DOMString to native strings (either type). These have no
+      # 'length' property as required by some tests, so simulate this.
+      #
+      if propName=='length' and type(obj) in (type(''), type(u'')):
+        value= len(obj)
+      else:
+
+        # Try to read property
+        #
+        try:
+          token= watchdog.arm()
+          try:
+            value= get(obj, propName)
+          finally:
+            watchdog.disarm(token)
+        except AttributeError, e:
+          try:
+            strobj= str(obj)
+          except Exception, e:
+            strobj= '(unprintable object)'
+          raise TestException('Missing property %s on %s'%(propName,strobj),e)
+        except NonErrors:
+          raise
+        except (TestException, AssertionError, ReturnValue):
+          raise
+        except Exception, e:
+          try:
+            strobj= str(obj)
+          except Exception, e:
+            strobj= '(unprintable object)'
+          raise TestException('Getting %s on %s' % (propName,strobj), e)
+
+      # Write to variable
+      #
+      if varName is not None:
+        self.scope[varName]= value
+    return statement
 
 
-  def setProperty(self, testNode):
-    obj= self.ueval(testNode.getAttribute('obj'))
+  def compileSetProperty(self, testNode):
     propName= testNode.tagName
-    value= self.ueval(testNode.getAttribute('value'))
+    objExpr= testNode.getAttribute('obj')
+    valueExpr= testNode.getAttribute('value')
 
-    # Check for the existance of property first - DOM settable properties must
-    # gettable, but Python does not enforce this restriction explicitly.
-    #
-    try:
-      has= hasattr(obj, propName)
-    except NonErrors:
-      raise
-    except (TestException, AssertionError, ReturnValue):
-      raise
-    except Exception, e:
-      raise TestException('Broken %s on %s' % (propName,str(obj)), e)
-    if not has:
-      raise TestException('Missing property %s on %s' % (propName, str(obj)),
-        AttributeError()
-      )
+    watchdog= self.watchdog
+    setter= self.timed('set', propName, setattr)
+    def statement():
+      obj= self.ueval(objExpr)
+      value= self.ueval(valueExpr)
 
-    # Attempt to write to property
-    #
-    interrupter= Interrupter()
-    try:
-      interrupter.start()
+      # Check for the existance of property first - DOM settable properties
+      # must gettable, but Python does not enforce this restriction explicitly.
+      #
       try:
-        setattr(obj, propName, value)
-      finally:
-        interrupter.finish()
-    except NonErrors:
-      raise
-    except Exception, e:
-      raise TestException('Setting %s on %s' % (propName,str(obj)), e)
+        has= hasattr(obj, propName)
+      except NonErrors:
+        raise
+      except (TestException, AssertionError, ReturnValue):
+        raise
+      except Exception, e:
+        raise TestException('Broken %s on %s' % (propName,str(obj)), e)
+      if not has:
+        raise TestException('Missing property %s on %s' % (propName,str(obj)),
+          AttributeError()
+        )
+
+      # Attempt to write to property
+      #
+      try:
+        token= watchdog.arm()
+        try:
+          setter(obj, propName, value)
+        finally:
+          watchdog.disarm(token)
+      except NonErrors:
+        raise
+      except Exception, e:
+        raise TestException('Setting %s on %s' % (propName,str(obj)), e)
+    return statement
 
 
-  def makeAssertion(self, testNode):
-    assertContents= testNode.getElementsByTagName('*')
-    assertType= testNode.tagName[6].lower()+testNode.tagName[7:]  
+  def compileAssertion(self, testNode):
+    assertContents= testNode.elements
+    assertType= testNode.tagName[6].lower()+testNode.tagName[7:]
+    assertId= testNode.getAttribute('id')
+    comparer= CONDITIONS[assertType]
+    condition= None
+    actualExpr= None
+    bitmask= None
     if len(assertContents)>0:
-      actual= self.checkCondition(assertContents[0])
+      condition= self.compileCondition(assertContents[0])
     else:
-      actual= self.getOneOf(testNode, ACTUALS)
+      actualExpr= findOneOf(testNode, ACTUALS)
       if testNode.hasAttribute('bitmask'):
-        actual= actual & int(testNode.getAttribute('bitmask'))
-    expected= self.getOneOf(testNode, EXPECTEDS)
+        bitmask= int(testNode.getAttribute('bitmask'))
+    expectedExpr= findOneOf(testNode, EXPECTEDS)
+    absoluteExpr= None
     if testNode.hasAttribute('isAbsolute'):
-      ab= self.ueval(testNode.getAttribute('isAbsolute'))
-      if ab and expected is not None:
-        # see if it could be an external entity first. TSML files don't
-        # specify, weird
-        path= os.path.join(self.filesPath, expected+'.ent')
-        if not os.path.exists(path):
-          ext= self.implementation.extension
-          path= os.path.join(self.filesPath, expected+ext)
-        expected= 'file:'+urllib.pathname2url(path)
-    cs= True
+      absoluteExpr= testNode.getAttribute('isAbsolute')
+    ignoreCaseExpr= None
     if testNode.hasAttribute('ignoreCase'):
-      cs= not self.ueval(testNode.getAttribute('ignoreCase'))
-    if not CONDITIONS[assertType](actual, expected, cs):
-      if expected is not None:
-        raise AssertionError('Assertion %s failed. Expected %s, got %s' % (
-          testNode.getAttribute('id'), sstr(expected), sstr(actual)
-        ))
+      ignoreCaseExpr= testNode.getAttribute('ignoreCase')
+
+    def statement():
+      if condition is not None:
+        actual= condition()
       else:
-        raise AssertionError('Assertion %s failed. Got %s' % (
-          testNode.getAttribute('id'), actual
-        ))
+        actual= self.ueval(actualExpr)
+        if bitmask is not None:
+          actual= actual & bitmask
+      expected= self.ueval(expectedExpr)
+      if absoluteExpr is not None:
+        ab= self.ueval(absoluteExpr)
+        if ab and expected is not None:
+          # see if it could be an external entity first. TSML files don't
+          # specify, weird
+          path= os.path.join(self.filesPath, expected+'.ent')
+          if not os.path.exists(path):
+            ext= self.implementation.extension
+            path= os.path.join(self.filesPath, expected+ext)
+          expected= fileURI(path)
+      cs= True
+      if ignoreCaseExpr is not None:
+        cs= not self.ueval(ignoreCaseExpr)
+      if not comparer(actual, expected, cs):
+        if expected is not None:
+          raise AssertionError('Assertion %s failed. Expected %s, got %s' % (
+            assertId, sstr(expected), sstr(actual)
+          ))
+        else:
+          raise AssertionError('Assertion %s failed. Got %s' % (
+            assertId, actual
+          ))
+    return statement
 
 
-  def exceptionAssertion(self, testNode):
-    assertContents= testNode.getElementsByTagName('*')
+  def compileExceptionAssertion(self, testNode):
+    assertContents= testNode.elements
+    assertId= testNode.getAttribute('id')
     requiredException= None
     if len(assertContents)>0:
-      if assertContents[0].tagName in EXCEPTIONS:
-        requiredException= EXCEPTIONS.index(assertContents[0].tagName)
-        assertContents= assertContents[0].childNodes
-    try:
-      self.process(assertContents)
-    except TestException, e:
-      if requiredException is not None:
-        code= getattr(e.exception, 'code', None)
-        if code is not None and code>=len(EXCEPTIONS):
-          code= '?'
-        if code!=requiredException:
-          raise AssertionError('Assertion %s failed. Expected %s, got %s (%s, %s)'%(
-            testNode.getAttribute('id'), EXCEPTIONS[requiredException],
-            str(code), e.exception.__class__.__name__, str(e.exception)
-          ))
-    else:
-      if requiredException is not None:
-        raise AssertionError('Assertion %s failed. Expected %s, got none' % (
-          testNode.getAttribute('id'), EXCEPTIONS[requiredException]
-        ))
+      if EXCEPTIONCODES.has_key(assertContents[0].tagName):
+        requiredException= EXCEPTIONCODES[assertContents[0].tagName]
+        assertContents= assertContents[0].elements
+    body= self.compile(assertContents)
+
+    def statement():
+      try:
+        self.execute(body)
+      except TestException, e:
+        if requiredException is not None:
+          code= getattr(e.exception, 'code', None)
+          if code is not None and code>=len(EXCEPTIONS):
+            code= '?'
+          if code!=requiredException:
+            raise AssertionError('Assertion %s failed. Expected %s, got %s (%s, %s)'%(
+              assertId, EXCEPTIONS[requiredException],
+              str(code), e.exception.__class__.__name__, str(e.exception)
+            ))
       else:
-        raise AssertionError('Assertion %s failed. Exception didn\'t occur' %
-          testNode.getAttribute('id')
-        )
+        if requiredException is not None:
+          raise AssertionError('Assertion %s failed. Expected %s, got none' % (
+            assertId, EXCEPTIONS[requiredException]
+          ))
+        else:
+          raise AssertionError('Assertion %s failed. Exception didn\'t occur' %
+            assertId
+          )
+    return statement
 
 
-  def readVar(self, testNode):
+  def compileVar(self, testNode):
+    """ Compile a <var> declaration. Return the variable name and a callable
+        that makes its initial value.
+    """
     name= testNode.getAttribute('name')
-    value= None
-    if not testNode.hasAttribute('isNull') or not self.ueval(testNode.getAttribute('isNull')):
-      varType= testNode.getAttribute('type')
-      if testNode.hasAttribute('value'):
-        value= self.ueval(testNode.getAttribute('value'))
+    isNullExpr= None
+    if testNode.hasAttribute('isNull'):
+      isNullExpr= testNode.getAttribute('isNull')
+    varType= testNode.getAttribute('type')
+    valueExpr= None
+    if testNode.hasAttribute('value'):
+      valueExpr= testNode.getAttribute('value')
 
-      # Initialise complex types
-      #
-      if varType in COMPLEXOBJECTS.keys():
-        value= COMPLEXOBJECTS[varType](value)
-        for child in testNode.childNodes:
-          if child.nodeType==child.ELEMENT_NODE:
-            propType= child.tagName
-            if propType=='member':
-              value.append(self.ueval(getTextContent(child)))
-            elif propType=='var':
-              (propName, propValue)= self.readVar(child)
-              setattr(value, propName, propValue)
-            elif propType in METHODS.keys():
-              value.setMethod(propType, TSMethod(value, child, self))
-            elif propType in PROPERTIES:
-              for grandchild in child.childNodes:
-                if grandchild.nodeType==child.ELEMENT_NODE:
-                  gsName= grandchild.tagName
-                  if gsName=='get':
-                    value.setGetter(propType, TSMethod(value, grandchild, self))
-                  elif gsName=='set':
-                    value.setSetter(propType, TSMethod(value, grandchild, self))
-                  else:
-                    raise ValueError('Unknown TSML property child %s' % gsName)
-            else:
-              raise ValueError('Unknown TSML property element %s' %propType)
+    # Complex types are built by a list of setup steps, each of which takes
+    # the new object as an argument
+    #
+    constructor= None
+    setup= []
+    if COMPLEXOBJECTS.has_key(varType):
+      constructor= COMPLEXOBJECTS[varType]
+      for child in testNode.childNodes:
+        if child.nodeType==child.ELEMENT_NODE:
+          propType= child.tagName
+          if propType=='member':
+            setup.append(self.compileMember(child))
+          elif propType=='var':
+            setup.append(self.compileMemberVar(child))
+          elif METHODS.has_key(propType):
+            setup.append(self.compileMemberMethod(propType, child))
+          elif propType in PROPERTIES:
+            for grandchild in child.childNodes:
+              if grandchild.nodeType==child.ELEMENT_NODE:
+                gsName= grandchild.tagName
+                if gsName in ('get', 'set'):
+                  setup.append(
+                    self.compileMemberAccessor(propType, grandchild)
+                  )
+                else:
+                  setup.append(setupRaiser(
+                    ValueError('Unknown TSML property child %s' % gsName)
+                  ))
+          else:
+            setup.append(setupRaiser(
+              ValueError('Unknown TSML property element %s' %propType)
+            ))
+    elif SIMPLEOBJECTS.has_key(varType):
+      constructor= SIMPLEOBJECTS[varType]
 
-      # Initialise simple types
-      #
-      elif varType in SIMPLEOBJECTS.keys():
-          value= SIMPLEOBJECTS[varType](value)
+    def initialiser():
+      value= None
+      if isNullExpr is None or not self.ueval(isNullExpr):
+        if valueExpr is not None:
+          value= self.ueval(valueExpr)
+        if constructor is not None:
+          value= constructor(value)
+        for step in setup:
+          step(value)
+      return value
+    return (name, initialiser)
 
-    return (name, value)
+  def compileMember(self, testNode):
+    memberExpr= getTextContent(testNode)
+    def step(value):
+      value.append(self.ueval(memberExpr))
+    return step
 
+  def compileMemberVar(self, testNode):
+    (propName, initialiser)= self.compileVar(testNode)
+    def step(value):
+      setattr(value, propName, initialiser())
+    return step
 
-  def ifCondition(self, testNode):
-    conditionNode= None
+  def compileMemberMethod(self, methodName, testNode):
+    argNames= METHODS[methodName]
+    body= self.compile(testNode.childNodes)
+    def step(value):
+      value.setMethod(methodName, TSMethod(value, methodName, argNames, body, self))
+    return step
+
+  def compileMemberAccessor(self, propName, testNode):
+    gsName= testNode.tagName
+    body= self.compile(testNode.childNodes)
+    if gsName=='get':
+      def step(value):
+        value.setGetter(propName, TSMethod(value, gsName, [], body, self))
+    else:
+      def step(value):
+        value.setSetter(propName, TSMethod(value, gsName, ['value'], body, self))
+    return step
+
+
+  def compileIfCondition(self, testNode):
+    # The first child element is the condition; the rest, apart from the
+    # last <else>, make up the body.
+    #
+    elements= testNode.elements
+    conditionNode= elements[0]
     elseNode= None
-    for child in testNode.childNodes:
-      if child.nodeType==child.ELEMENT_NODE and conditionNode is None:
-        conditionNode= child
-      if child.nodeType==child.ELEMENT_NODE and child.tagName=='else':
+    for child in elements:
+      if child.tagName=='else':
         elseNode= child
-    if self.checkCondition(conditionNode):
-      contents= list(testNode.childNodes)
-      contents.remove(conditionNode)
-      if elseNode is not None:
-        contents.remove(elseNode)
-      self.process(contents)
-    elif elseNode is not None:
-      self.process(elseNode.childNodes)
+    condition= self.compileCondition(conditionNode)
+    contents= []
+    for child in elements[1:]:
+      if child is not elseNode:
+        contents.append(child)
+    body= self.compile(contents)
+    elseBody= None
+    if elseNode is not None:
+      elseBody= self.compile(elseNode.elements)
+
+    def statement():
+      if condition():
+        self.execute(body)
+      elif elseBody is not None:
+        self.execute(elseBody)
+    return statement
+
 
+  def compileWhileLoop(self, testNode):
+    condition= self.compileCondition(testNode.elements[0])
+    body= self.compile(testNode.elements[1:])
 
-  def whileLoop(self, testNode):
-    conditionNode= testNode.getElementsByTagName('*')[0]
-    contents= list(testNode.childNodes)
-    contents.remove(conditionNode)
-    while self.checkCondition(conditionNode):
-      self.process(contents)
+    def statement():
+      while condition():
+        self.execute(body)
+    return statement
 
 
-  def forLoop(self, testNode):
+  def compileForLoop(self, testNode):
+    # A loop whose body can't change anything streams through the
+    # collection as it goes, unless the Tester says otherwise. Others copy
+    # the collection first, so that removing or adding nodes can't affect
+    # which members are visited.
+    #
     member= testNode.getAttribute('member')
-    collection= self.ueval(testNode.getAttribute('collection'))
-    if hasattr(collection, 'item'):
-      collectionList= []
-      for ix in range(collection.length):
-        collectionList.append(collection.item(ix))
-    else:
-      try:
-        collectionList= list(collection)
-      except NonErrors:
-        raise
-      except Exception, e:
-        raise TestException('Reading list %s' % collection, e)
-    for self.scope[member] in collectionList:
-      self.process(testNode.childNodes)
+    collectionExpr= testNode.getAttribute('collection')
+    body= self.compile(testNode.childNodes)
+    mode= self.iteration
+    if mode=='auto':
+      if isReadOnly(testNode):
+        mode= 'stream'
+      else:
+        mode= 'snapshot'
+
+    def statement():
+      collection= self.ueval(collectionExpr)
+      self.iterations[mode]= self.iterations[mode]+1
+      if mode=='stream':
+        collectionList= iterate(collection)
+      elif hasattr(collection, 'item'):
+        collectionList= []
+        for ix in range(collection.length):
+          collectionList.append(collection.item(ix))
+      else:
+        try:
+          collectionList= list(collection)
+        except NonErrors:
+          raise
+        except Exception, e:
+          raise TestException('Reading list %s' % collection, e)
+      for item in collectionList:
+        self.scope[member]= item
+        self.execute(body)
+    return statement
+
 
-  def tryBlock(self, testNode):
+  def compileTryBlock(self, testNode):
+    # Catches are held as (code, body) pairs. code is None to catch any
+    # ImplementationException, or the name of the DOMException code.
+    #
     catches= []
     others= []
     for child in testNode.childNodes:
       if child.nodeType==child.ELEMENT_NODE and child.tagName=='catch':
         for grandchild in child.childNodes:
           if grandchild.nodeType==child.ELEMENT_NODE:
-            catches.append(grandchild)
+            if grandchild.tagName=='ImplementationException':
+              code= None
+            else:
+              code= grandchild.getAttribute('code')
+            catches.append((code, self.compile(grandchild.childNodes)))
       else:
         others.append(child)
-    try:
-      self.process(others)
-    except TestException, e:
-      for catch in catches:
-        if catch.tagName!='ImplementationException':
-          if hasattr(e.exception, 'code'):
-            if e.exception.code==EXCEPTIONS.index(catch.getAttribute('code')):
-              break
-        if catch.tagName=='ImplementationException':
-          break
-      else:
-        raise # exception had no matching <catch>
-      self.process(catch.childNodes)
+    body= self.compile(others)
+
+    def statement():
+      try:
+        self.execute(body)
+      except TestException, e:
+        for (code, catchBody) in catches:
+          if code is not None:
+            if hasattr(e.exception, 'code'):
+              if e.exception.code==EXCEPTIONCODES[code]:
+                break
+          else:
+            break
+        else:
+          raise # exception had no matching <catch>
+        self.execute(catchBody)
+    return statement
+
+
+  def compileLoad(self, testNode):
+    t= testNode.tagName
+    varName= testNode.getAttribute('var')
+    href= testNode.getAttribute('href')
+
+    if t=='getResourceURI':
+      def statement():
+        ext= self.implementation.extension
+        hrefValue= self.ueval(href)
+        if hrefValue=='testpdf':
+          ext= '.pdf'
+        filePath= os.path.join(self.filesPath, hrefValue+ext)
+        self.scope[varName]= fileURI(filePath)
+    else:
+      shared= testNode.getAttribute('willBeModified')=='false'
+      load= self.timed('load', href, self.loadDocument)
+      def statement():
+        ext= self.implementation.extension
+        if href=='testpdf':
+          ext= '.pdf'
+        filePath= os.path.join(self.filesPath, href+ext)
+        try:
+          self.scope[varName]= load(filePath, shared)
+        except NonErrors:
+          raise
+        except Exception, e:
+          raise TestException('Document load failed', e)
+    return statement
 
 
-  def checkCondition(self, condNode):
+  def loadDocument(self, filePath, shared= False):
+    """ Parse a document for <load>. If the fixture cache is on, each file
+        is parsed only once for each configuration of implementation
+        attributes. A test gets the cached Document itself the first time it
+        loads it if it promised not to modify it, otherwise a copy.
+    """
+    if self.fixtures is None:
+      document= self.implementation.parseFile(filePath)
+      self.loaded.append(document)
+      return document
+    key= (filePath, self.implementation.attributeState())
+    document= self.fixtures.get(key)
+    if document is None:
+      document= self.implementation.parseFile(filePath)
+      self.fixtures[key]= document
+    if shared and not self.sharedFixtures.has_key(key):
+      self.sharedFixtures[key]= document
+      return document
+    copy= self.implementation.copyDocument(document)
+    if copy is None:
+      copy= self.implementation.parseFile(filePath)
+    self.loaded.append(copy)
+    return copy
+
+
+  def compileCondition(self, condNode):
+    """ Compile a condition element, as used inside <if>, <while> and
+        assertions. Return a callable returning its truth value.
+    """
     # If the condition is <not>, look inside it and invert the result
     #
-    if condNode.tagName=='not':
-      for child in condNode.childNodes:
-        if child.nodeType==child.ELEMENT_NODE:
-          return not self.checkCondition(child)
+    if condNode.tagName=='not' and len(condNode.elements)>0:
+      inner= self.compileCondition(condNode.elements[0])
+      return lambda: not inner()
 
     # If the condition is an operator like <or>, recurse into each subcondition
     #
     if CONDITIONOPS.has_key(condNode.tagName):
-      results= []
-      for child in condNode.childNodes:
-        if child.nodeType==child.ELEMENT_NODE:
-          results.append(self.checkCondition(child))
-      return reduce(CONDITIONOPS[condNode.tagName], results, False)
+      op= CONDITIONOPS[condNode.tagName]
+      subconditions= []
+      for child in condNode.elements:
+        subconditions.append(self.compileCondition(child))
+      def condition():
+        results= []
+        for subcondition in subconditions:
+          results.append(subcondition())
+        return reduce(op, results, False)
+      return condition
+
+    tagName= condNode.tagName
+    if not CONDITIONS.has_key(tagName):
+      return raiser(KeyError(tagName))
+    comparer= CONDITIONS[tagName]
+    expectedExpr= findOneOf(condNode, EXPECTEDS)
+    ignoreCaseExpr= None
+    if condNode.hasAttribute('ignoreCase'):
+      ignoreCaseExpr= condNode.getAttribute('ignoreCase')
 
-    if condNode.tagName=='contentType':
-      actual= self.implementation.contentType
+    if tagName=='contentType':
       expected= condNode.getAttribute('type')
+      def actualAndExpected():
+        return (self.implementation.contentType, expected)
+    elif tagName=='implementationAttribute':
+      attr= condNode.getAttribute('name')
+      def actualAndExpected():
+        actual= self.implementation.getImplementationAttribute(attr)
+        return (actual, self.ueval(expectedExpr))
     else:
-      if condNode.tagName=='implementationAttribute':
-        actual= self.implementation.getImplementationAttribute(
-          condNode.getAttribute('name')
-        )
-      else:
-        actual= self.getOneOf(condNode, ACTUALS)
-      expected= self.getOneOf(condNode, EXPECTEDS)
+      actualExpr= findOneOf(condNode, ACTUALS)
+      def actualAndExpected():
+        actual= self.ueval(actualExpr)
+        return (actual, self.ueval(expectedExpr))
 
-    cs= True
-    if condNode.hasAttribute('ignoreCase'):
-      cs= not self.ueval(condNode.getAttribute('ignoreCase'))
-      if cs is None:
-        cs= self.implementation.contentType!='text/html'
-    return CONDITIONS[condNode.tagName](actual, expected, cs)
+    def condition():
+      (actual, expected)= actualAndExpected()
+      cs= True
+      if ignoreCaseExpr is not None:
+        cs= not self.ueval(ignoreCaseExpr)
+        if cs is None:
+          cs= self.implementation.contentType!='text/html'
+      return comparer(actual, expected, cs)
+    return condition
 
 
   def ueval(self, expr):
-    """ Evaluate an expression string. TSML expressions are compatible with
-        Python except that in pre-2.3 Pythons Unicode characters can't be
-        included directly. Assuming they are in a string literal, encode them in
-        \u format and u-prefix the literal.
+    """ Evaluate an expression string, using the Tester's expression cache to
+        avoid recompiling it. An expression of None, standing for an absent
+        attribute, evaluates to None.
     """
-    if type(expr)==type(u'') and expr[:1]=='"':
-      ascii= 'u'
-      for char in expr:
-        if ord(char)>=128:
-          ascii= ascii+('\\u%04x' % ord(char))
-        else:
-          ascii= ascii+str(char)
-      expr= ascii
+    if expr is None:
+      return None
+    (constant, value)= self.expressions.lookup(expr)
+    if constant:
+      return value
     if self.globalScope is None:
-      value= eval(expr, self.scope)
-    else:
-      value= eval(expr, self.globalScope, self.scope)
-    return value
+      return eval(value, self.scope)
+    return eval(value, self.globalScope, self.scope)
 
-  def getOneOf(self, node, attrs):
-    """ Return the evaluated contents of any of the attributes specified in a
-        list, or None, if the element has no such attributes.
-    """
-    for attr in attrs:
-      if node.hasAttribute(attr):
-        return self.ueval(node.getAttribute(attr))
-    return None
+
+# Map of TSML statement element names to compilers. A compiler is called with
+# the Tester and the element, and returns a statement callable or None. Later
+# entries override earlier ones, giving the order of precedence for names that
+# are in more than one category.
+#
+STATEMENTS= {
+  'assign': Tester.compileAssign,
+  'append': Tester.compileAppend,
+  'substring': Tester.compileSubstring,
+  'for-each': Tester.compileForLoop,
+  'while': Tester.compileWhileLoop,
+  'if': Tester.compileIfCondition,
+  'try': Tester.compileTryBlock,
+  'fail': Tester.compileFail,
+  'return': Tester.compileReturn,
+  'var': Tester.compileVarStatement,
+  'implementationAttribute': Tester.compileImplementationAttribute,
+  'load': Tester.compileLoad,
+  'getResourceURI': Tester.compileLoad,
+  'createTempURI': Tester.compileCreateTempURI,
+  'createXPathEvaluator': Tester.compileCreateXPathEvaluator,
+  'debug': Tester.compileDebug,
+  'DOMImplementationRegistry.newInstance': Tester.compileRegistry
+}
+for t in BINARYOPS.keys():
+  STATEMENTS[t]= Tester.compileBinaryOp
+for t in UNARYOPS.keys():
+  STATEMENTS[t]= Tester.compileUnaryOp
+for t in EXCEPTIONASSERTS:
+  STATEMENTS[t]= Tester.compileExceptionAssertion
+for t in ASSERTS:
+  STATEMENTS[t]= Tester.compileAssertion
+for t in PROPERTIES:
+  STATEMENTS[t]= Tester.compileProperty
+STATEMENTS['implementation']= Tester.compileImplementation
+for t in METHODS.keys():
+  STATEMENTS[t]= Tester.compileMethod
+for t in IGNORE:
+  STATEMENTS[t]= Tester.compileIgnored
+STATEMENTS['hasFeature']= Tester.compileHasFeature
+
+def registerStatement(tagName, compiler):
+  """ Add or replace the compiler for a TSML statement element. compiler is
+      called as compiler(tester, element) when a test is compiled, and must
+      return a callable taking no arguments, or None to ignore the element.
+  """
+  STATEMENTS[tagName]= compiler
+
+
+def fileURI(path):
+  """ Return a file: URI for a local path.
+  """
+  import urllib
+  return 'file:'+urllib.pathname2url(path)
+
+def defaultTempRoot():
+  """ Return the directory to put tests' temporary files in: /dev/shm if it
+      can be used, so they stay in memory, else the system's usual one.
+  """
+  for path in TEMPROOTS:
+    if os.path.isdir(path) and os.access(path, os.W_OK|os.X_OK):
+      return path
+  import tempfile
+  return tempfile.gettempdir()
+
+# Memory-backed directories to prefer for temporary files
+#
+TEMPROOTS= ('/dev/shm',)
+
+# Ways to run <for-each> loops: 'snapshot' copies the collection before the
+# loop starts, 'stream' reads it as it goes, and 'auto' streams only loops
+# that can't change it.
+#
+ITERATIONS= ('auto', 'snapshot', 'stream')
+
+# Statements that change nothing but the test's own variables
+#
+PURESTATEMENTS= frozenset([
+  'assign', 'substring', 'for-each', 'while', 'if', 'else', 'not', 'try',
+  'catch', 'DOMException', 'ImplementationException', 'var', 'fail',
+  'return', 'debug', 'implementation'
+])
+
+def isReadOnly(node):
+  """ Is every statement inside an element known not to change any document
+      or collection?
+  """
+  for child in node.elements:
+    tagName= child.tagName
+    if tagName in PROPERTIES:
+      if child.hasAttribute('value'):
+        return False
+    elif not (tagName in PURESTATEMENTS or tagName in QUERIES or
+      tagName in ASSERTS or tagName in EXCEPTIONASSERTS or tagName in IGNORE or
+      CONDITIONS.has_key(tagName) or CONDITIONOPS.has_key(tagName) or
+      UNARYOPS.has_key(tagName) or BINARYOPS.has_key(tagName) or
+      EXCEPTIONCODES.has_key(tagName)
+    ):
+      return False
+    if not isReadOnly(child):
+      return False
+  return True
+
+def iterate(collection):
+  """ Yield the members of a collection one at a time, using its own
+      iteration if it has any, or else its DOM length and item.
+  """
+  if hasattr(collection, 'item') and not hasattr(collection, '__iter__'):
+    ix= 0
+    while ix<collection.length:
+      yield collection.item(ix)
+      ix= ix+1
+    return
+  try:
+    iterator= iter(collection)
+  except NonErrors:
+    raise
+  except Exception, e:
+    raise TestException('Reading list %s' % collection, e)
+  while True:
+    try:
+      item= iterator.next()
+    except StopIteration:
+      return
+    except NonErrors:
+      raise
+    except Exception, e:
+      raise TestException('Reading list %s' % collection, e)
+    yield item
+
+def isDocument(value):
+  """ Is a value a DOM Document node?
+  """
+  try:
+    return getattr(value, 'nodeType', None)==9
+  except NonErrors:
+    raise
+  except Exception:
+    return False
+
+def findOneOf(node, attrs):
+  """ Return the expression in the first of the attributes specified in a list
+      that the element has, or None if the element has no such attributes.
+  """
+  for attr in attrs:
+    if node.hasAttribute(attr):
+      return node.getAttribute(attr)
+  return None
+
+def raiser(exception):
+  """ Make a compiled statement that raises an exception when executed.
+  """
+  def statement():
+    raise exception
+  return statement
+
+def setupRaiser(exception):
+  """ Make a complex object setup step that raises an exception.
+  """
+  def step(value):
+    raise exception
+  return step
 
 
 class TSMethod:
   """ Object representing a test-created method in a test-created object. If
       it gets called (either by the test or by callback from the DOM), it
-      passes its body node back to the Tester to run, with a local scope
+      passes its compiled body back to the Tester to run, with a local scope
       containing arguments and object members.
   """
-  def __init__(self, obj, node, tester):
+  def __init__(self, obj, methodName, argNames, body, tester):
     self.obj= obj
-    self.node= node
+    self.methodName= methodName
+    self.argNames= argNames
+    self.body= body
     self.tester= tester
   def __call__(self, *args):
-    methodName= self.node.tagName
-    if methodName=='get':
-      argNames= []
-    elif methodName=='set':
-      argNames= ['value']
-    else:
-      argNames= METHODS[methodName]
+    argNames= self.argNames
     if len(argNames)!=len(args):
       raise TypeError('TSMethod %s takes exactly %d arguments, %d given' % (
-        methodName, len(argNames), len(args)
+        self.methodName, len(argNames), len(args)
       ))
     scope= self.obj.__dict__
 
@@ -624,7 +1176,7 @@ class TSMethod:
     # Interpret method body. Get a <return> value if there is one.
     #
     try:
-      self.tester.process(self.node.childNodes)
+      self.tester.execute(self.body)
     except ReturnValue, e:
       value= e.value
     else:
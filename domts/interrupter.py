@@ -2,11 +2,18 @@
     hanging the tests in an infinite loop. Unfortunately there is no portable
     way to kill a thread in Python; the best we can do is print an error
     message to provoke the user into pressing Ctrl-C.
+
+    A single long-lived watchdog thread is shared by all calls. Arming it
+    before a call and disarming it afterwards is just a couple of attribute
+    assignments; the thread itself wakes up periodically to see whether the
+    same call has been armed for too long.
 """
 
-__all__= ['Interrupter']
+__all__= [
+  'Interrupter', 'Watchdog', 'getWatchdog', 'UnresponsiveDOMTimeoutInterrupt'
+]
 
-import sys, threading
+import sys, time, threading
 try: True
 except NameError: globals()['True'],globals()['False']= not None, not not None
 
@@ -14,24 +21,86 @@ except NameError: globals()['True'],globals()['False']= not None, not not None
 #
 TIMEOUT= 15
 
-class Interrupter(threading.Thread):
+# Interval between the watchdog's checks, in seconds. A hung call will be
+# noticed between TIMEOUT and TIMEOUT+2*POLL seconds after it started.
+#
+POLL= 0.5
+
+class Watchdog(threading.Thread):
+  """ Thread watching the call currently in progress. Each arm() gives the
+      call a new serial number; the thread reports a call whose serial number
+      has stayed armed for longer than TIMEOUT.
+  """
   def __init__(self):
-      threading.Thread.__init__(self)
-      self.finished= threading.Event()
-      self.interrupted= threading.Event()
-  def finish(self):
-    self.finished.set()
-    if self.interrupted.isSet():
+    threading.Thread.__init__(self)
+    self.setDaemon(True)
+    self.serial= 0
+    self.armed= 0
+    self.interrupted= 0
+
+  def arm(self):
+    """ Start watching a call. Return a token to be passed to disarm when the
+        call is finished. Calls may be nested (eg. by DOM callbacks into test
+        code); only the innermost one is watched.
+    """
+    previous= self.armed
+    self.serial= self.serial+1
+    self.armed= self.serial
+    return previous
+
+  def disarm(self, token):
+    """ Stop watching the current call. If it overran, raise the interrupt so
+        that the test is abandoned.
+    """
+    armed= self.armed
+    self.armed= token
+    if armed==self.interrupted:
+      self.interrupted= 0
       sys.stderr.write('Test aborted. Continuing suite.\n')
       raise UnresponsiveDOMTimeoutInterrupt()
+
   def run(self):
-    self.finished.wait(TIMEOUT)
-    if not self.finished.isSet():
-      self.interrupted.set()
-      sys.stderr.write(
-        'Probable infinite loop in implementation. Press Ctrl-C to abort.\n'
-      )
+    watching= 0
+    since= time.time()
+    while True:
+      time.sleep(POLL)
+      armed= self.armed
+      now= time.time()
+      if armed!=watching:
+        watching= armed
+        since= now
+      elif armed!=0 and armed!=self.interrupted and now-since>=TIMEOUT:
+        self.interrupted= armed
+        sys.stderr.write(
+          'Probable infinite loop in implementation. Press Ctrl-C to abort.\n'
+        )
+
+
+_watchdog= None
+
+def getWatchdog():
+  """ Get the shared Watchdog, starting it if there isn't one running in this
+      process (there won't be after a fork).
+  """
+  global _watchdog
+  if _watchdog is None or not _watchdog.isAlive():
+    _watchdog= Watchdog()
+    _watchdog.start()
+  return _watchdog
+
+
+class Interrupter:
+  """ Watch a single call using the shared Watchdog. Kept for compatibility;
+      the interpreter arms the Watchdog directly.
+  """
+  def __init__(self):
+    self.watchdog= getWatchdog()
+    self.token= None
+  def start(self):
+    self.token= self.watchdog.arm()
+  def finish(self):
+    self.watchdog.disarm(self.token)
 
 
 class UnresponsiveDOMTimeoutInterrupt(Exception):
-  pass
\ No newline at end of file
+  pass
@@ -0,0 +1,92 @@
+""" domts.profiling: count and time everything a test does - each kind of
+    TSML element executed, and each DOM method called and property got or
+    set - to find out where the time in a slow suite goes.
+"""
+
+__all__= ['Profiler']
+
+import math
+from timeit import default_timer as timer
+
+# Number of histogram buckets. Bucket n holds calls taking less than 2**n
+# microseconds; the last also holds anything slower.
+#
+BUCKETS= 24
+
+class Profiler:
+  """ Profiler for a Tester. Keeps, for each (implementation, kind, name), a
+      list of [count, total seconds, histogram]. Kinds are 'element' for TSML
+      elements (timed including any elements inside them), 'method', 'get' and
+      'set' for DOM members and 'load' for parsing documents.
+  """
+  def __init__(self, implementationName= None):
+    self.implementationName= implementationName
+    self.stats= {}
+
+  def timed(self, kind, name, call):
+    key= (self.implementationName, kind, name)
+    def timedCall(*args):
+      start= timer()
+      try:
+        return apply(call, args)
+      finally:
+        self.record(key, timer()-start)
+    return timedCall
+
+  def record(self, key, seconds):
+    stat= self.stats.get(key)
+    if stat is None:
+      stat= self.stats[key]= [0, 0.0, [0]*BUCKETS]
+    stat[0]= stat[0]+1
+    stat[1]= stat[1]+seconds
+    bucket= 0
+    if seconds>0:
+      bucket= min(max(math.frexp(seconds*1e6)[1], 0), BUCKETS-1)
+    stat[2][bucket]= stat[2][bucket]+1
+
+  def drain(self):
+    """ Return the stats gathered so far and start again, for passing the
+        results of a worker process back to be merged.
+    """
+    stats= self.stats
+    self.stats= {}
+    return stats
+
+  def merge(self, stats):
+    for (key, (count, total, histogram)) in stats.items():
+      stat= self.stats.get(key)
+      if stat is None:
+        stat= self.stats[key]= [0, 0.0, [0]*BUCKETS]
+      stat[0]= stat[0]+count
+      stat[1]= stat[1]+total
+      for ix in range(BUCKETS):
+        stat[2][ix]= stat[2][ix]+histogram[ix]
+
+  def export(self):
+    """ Return the stats as nested dictionaries suitable for writing as JSON:
+        implementation -> kind -> name -> {count, total, histogram}, with the
+        histogram as a list of [upper bound in microseconds, count] for the
+        buckets in use.
+    """
+    data= {}
+    for ((implementationName, kind, name), stat) in self.stats.items():
+      kinds= data.setdefault(str(implementationName), {})
+      histogram= []
+      for ix in range(BUCKETS):
+        if stat[2][ix]!=0:
+          histogram.append([2**ix, stat[2][ix]])
+      kinds.setdefault(kind, {})[name]= {
+        'count': stat[0], 'total': stat[1], 'histogram': histogram
+      }
+    return data
+
+  def write(self, path):
+    try:
+      import json
+    except ImportError:
+      import simplejson as json
+    f= open(path, 'w')
+    try:
+      json.dump(self.export(), f, indent= 1, sort_keys= True)
+    finally:
+      f.close()
@@ -0,0 +1,186 @@
+""" domts.reporting: collect results as a suite runs, and summarise them.
+"""
+
+__all__= ['Reporter', 'Result', 'ResultWriter']
+
+import sys, time
+from interpreter import sstr
+from timing import PHASES
+
+
+class Result(object):
+  """ Record of a test's result. Holds the test name, passed and skipped
+      flags, the failure or skip message rendered as a string (so that the
+      exception, and everything it refers to, can be freed at once), the
+      timings (None, or a dictionary of phase name from timing.PHASES to a
+      (wall, cpu) tuple of seconds) and the path of the test file. Can be
+      indexed and unpacked as the (testName, passedFlag, skippedFlag,
+      failInfo) tuple that results used to be.
+  """
+  __slots__= ('testName', 'passed', 'skipped', 'info', 'timings', 'path')
+
+  def __init__(self, testName, passed, skipped, info,
+    timings= None, path= None
+  ):
+    if info is not None:
+      info= sstr(info)
+    self.testName= testName
+    self.passed= passed
+    self.skipped= skipped
+    self.info= info
+    self.timings= timings
+    self.path= path
+
+  def status(self):
+    if self.skipped:
+      return 'skipped'
+    if self.passed:
+      return 'passed'
+    return 'failed'
+
+  def asTuple(self):
+    return (self.testName, self.passed, self.skipped, self.info)
+  def __getitem__(self, index):
+    return self.asTuple()[index]
+  def __len__(self):
+    return 4
+  def __iter__(self):
+    return iter(self.asTuple())
+  def __eq__(self, other):
+    if isinstance(other, Result):
+      other= other.asTuple()
+    elif not isinstance(other, tuple):
+      return NotImplemented
+    return self.asTuple()==other
+  def __ne__(self, other):
+    equal= self.__eq__(other)
+    if equal is NotImplemented:
+      return NotImplemented
+    return not equal
+  def __repr__(self):
+    return 'Result%s' % repr(self.asTuple())
+  def __reduce__(self):
+    return (self.__class__, self.asTuple()+(self.timings, self.path))
+
+  def asDict(self):
+    """ Return the result as a dictionary suitable for writing as JSON.
+    """
+    data= {
+      'test': self.testName, 'status': self.status(), 'info': self.info,
+      'path': self.path
+    }
+    if self.timings is not None:
+      timings= {}
+      for (phase, (wall, cpu)) in self.timings.items():
+        timings[phase]= {'wall': wall, 'cpu': cpu}
+      data['timings']= timings
+    return data
+
+
+class Reporter:
+  """ Collect results from iterSuite. Only the number of passed tests is kept,
+      and the names and messages of failed and skipped ones, so memory use
+      does not grow with the size of the suite. If given a live stream, each
+      failure is written to it as it happens, along with a progress count if
+      the stream is a terminal.
+  """
+  def __init__(self, live= None):
+    self.live= live
+    self.interactive= False
+    if live is not None and hasattr(live, 'isatty'):
+      self.interactive= live.isatty()
+    self.passed= 0
+    self.failed= []
+    self.skipped= []
+    self.timed= 0
+    self.timings= {}
+
+  def add(self, result):
+    (testName, passed, skipped, info)= result[:4]
+    timings= getattr(result, 'timings', None)
+    if timings is not None:
+      self.timed= self.timed+1
+      for (phase, (wall, cpu)) in timings.items():
+        total= self.timings.setdefault(phase, [0.0, 0.0])
+        total[0]= total[0]+wall
+        total[1]= total[1]+cpu
+    if skipped:
+      self.skipped.append((testName, sstr(info)))
+    elif passed:
+      self.passed= self.passed+1
+    else:
+      self.failed.append((testName, sstr(info)))
+      if self.live is not None:
+        if self.interactive:
+          self.live.write('\r')
+        self.live.write('FAILED %s: %s\n' % self.failed[-1])
+    if self.interactive:
+      self.live.write('\r%d passed, %d failed, %d skipped' % (
+        self.passed, len(self.failed), len(self.skipped)
+      ))
+      self.live.flush()
+
+  def summarise(self, out= None):
+    """ Write the list of failed and skipped tests.
+    """
+    if out is None:
+      out= sys.stdout
+    if self.interactive:
+      self.live.write('\n')
+    passed= self.passed
+    failed= self.failed
+    skipped= self.skipped
+    if len(failed)==0 and len(skipped)==0:
+      out.write('PASSED ALL %d tests!\n' % passed)
+    else:
+      out.write('PASSED %d test%s\n' % (passed, ['s', ''][passed==1]))
+    if len(failed)!=0:
+      out.write('FAILED %d test%s:\n' % (len(failed), ['s', ''][len(failed)==1]))
+      for fail in failed:
+        out.write('  %s: %s\n' % fail)
+    if len(skipped)!=0:
+      out.write('SKIPPED %d test%s:\n'%(len(skipped), ['s', ''][len(skipped)==1]))
+      for skip in skipped:
+        out.write('  %s: %s\n' % skip)
+    if self.timed!=0:
+      out.write('TIMINGS over %d test%s (seconds): wall, cpu\n' % (
+        self.timed, ['s', ''][self.timed==1]
+      ))
+      for phase in PHASES:
+        if self.timings.has_key(phase):
+          out.write('  %-12s %9.3f %9.3f\n' % (
+            (phase+':',)+tuple(self.timings[phase])
+          ))
+
+
+class ResultWriter:
+  """ Write results to a file as they arrive, one JSON object per line, as
+      given by Result.asDict. The file is flushed every FLUSH results, or
+      after INTERVAL seconds, so that a run which is stopped leaves complete
+      lines behind and nothing is held in memory.
+  """
+  FLUSH= 100
+  INTERVAL= 5.0
+
+  def __init__(self, out):
+    try:
+      import json
+    except ImportError:
+      import simplejson as json
+    self.dumps= json.dumps
+    self.out= out
+    self.pending= 0
+    self.flushed= time.time()
+
+  def add(self, result):
+    if not isinstance(result, Result):
+      result= apply(Result, tuple(result[:4]))
+    self.out.write(self.dumps(result.asDict(), sort_keys= True)+'\n')
+    self.pending= self.pending+1
+    if self.pending>=self.FLUSH or time.time()-self.flushed>=self.INTERVAL:
+      self.flush()
+
+  def flush(self):
+    self.out.flush()
+    self.pending= 0
+    self.flushed= time.time()
@@ -0,0 +1,167 @@
+""" domts.store: caches kept on disk between runs of the test suite.
+"""
+
+__all__= ['DocumentCache', 'ResultStore', 'fileDigest']
+
+import os, marshal
+try:
+  from hashlib import md5
+except ImportError:
+  from md5 import new as md5
+import tsml
+from interpreter import sstr
+try: True
+except NameError: globals()['True'],globals()['False']= not None, not not None
+
+
+def readFile(path):
+  f= open(path, 'rb')
+  try:
+    return f.read()
+  finally:
+    f.close()
+
+def fileDigest(path):
+  """ Return the MD5 of a file's content in hex, or None if it can't be read.
+  """
+  try:
+    return md5(readFile(path)).hexdigest()
+  except IOError:
+    return None
+
+def writeFile(path, data):
+  """ Write a file so that other processes sharing the store never see it
+      partly written.
+  """
+  temp= '%s.%d.tmp' % (path, os.getpid())
+  f= open(temp, 'wb')
+  try:
+    f.write(data)
+  finally:
+    f.close()
+  try:
+    os.rename(temp, path)
+  except OSError:
+    os.remove(temp)
+
+
+class DocumentCache:
+  """ Cache of test and suite documents in the slim form of domts.tsml, so
+      that a re-run need not read them again. Entries are keyed by a hash of
+      the file content, the domts version and the name of the reader that
+      read it. Changes to external entities a document includes are not
+      noticed.
+  """
+  def __init__(self, directory, version):
+    self.directory= directory
+    self.version= version
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  def key(self, data, readerName):
+    digest= md5()
+    digest.update('%s\0%s\0%d\0' % (self.version, readerName, marshal.version))
+    digest.update(data)
+    return digest.hexdigest()
+
+  def parse(self, path, read, readerName):
+    """ Return the slim Document for a file, from the cache if possible, else
+        by calling read with its path and storing the result.
+    """
+    entry= os.path.join(self.directory, self.key(readFile(path),readerName)+'.tsml')
+    try:
+      return tsml.fromTuples(marshal.loads(readFile(entry)))
+    except (IOError, EOFError, ValueError, TypeError, IndexError):
+      pass
+    document= read(path)
+    writeFile(entry, marshal.dumps(tsml.toTuples(document)))
+    return document
+
+
+class ResultStore:
+  """ Results of earlier runs, reused for tests whose inputs have not changed.
+      Entries are keyed by the test file's path and content, the domts
+      version, the identity of the tested implementation, the DTD and entity
+      files in the suite's files directory and any settings given that
+      affect what a test does. Each records the documents the test loads or
+      gets the URIs of and their digests, which must also be unchanged for
+      the result to be reused. Tests that work out which file to use while
+      running are not stored.
+  """
+  def __init__(self, directory, version, testImp, filesPath, settings= ()):
+    self.directory= directory
+    self.filesPath= filesPath
+    self.extension= testImp.extension
+    self.digests= {}
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    support= []
+    if os.path.isdir(filesPath):
+      for name in os.listdir(filesPath):
+        if os.path.splitext(name)[1] in ('.dtd', '.ent'):
+          support.append((name, self.digest(os.path.join(filesPath, name))))
+    support.sort()
+    self.prefix= '%s\0%s\0%s\0%s\0' % (
+      version, testImp.identity(), repr(support), repr(tuple(settings))
+    )
+
+  def digest(self, path):
+    """ Return the digest of a file, reading it only once per run.
+    """
+    if not self.digests.has_key(path):
+      self.digests[path]= fileDigest(path)
+    return self.digests[path]
+
+  def entry(self, testPath):
+    testPath= os.path.abspath(testPath)
+    digest= md5(self.prefix)
+    digest.update('%s\0%s' % (testPath, self.digest(testPath)))
+    return os.path.join(self.directory, digest.hexdigest()+'.result')
+
+  def fixtures(self, testDoc):
+    """ Return the paths of the documents a test loads or gets the URIs of,
+        or None if some can't be known without running it.
+    """
+    from features import staticValue, NotStatic
+    paths= []
+    for tagName in ('load', 'getResourceURI'):
+      for element in testDoc.getElementsByTagName(tagName):
+        href= element.getAttribute('href')
+        if tagName=='getResourceURI':
+          try:
+            href= staticValue(href)
+          except NotStatic:
+            return None
+        ext= self.extension
+        if href=='testpdf':
+          ext= '.pdf'
+        paths.append(os.path.join(self.filesPath, href+ext))
+    return paths
+
+  def lookup(self, testPath):
+    """ Return the stored (testName, passed, skipped, info) tuple for a test,
+        or None if there isn't one or its inputs have changed. Failure
+        information comes back as the message string.
+    """
+    try:
+      (fixtures, result)= marshal.loads(readFile(self.entry(testPath)))
+    except (IOError, EOFError, ValueError, TypeError):
+      return None
+    for (path, digest) in fixtures:
+      if self.digest(path)!=digest:
+        return None
+    return result
+
+  def save(self, testPath, testDoc, result):
+    paths= self.fixtures(testDoc)
+    if paths is None:
+      return
+    fixtures= []
+    for path in paths:
+      fixtures.append((path, self.digest(path)))
+    (testName, passed, skipped, info)= result[:4]
+    if info is not None:
+      info= sstr(info)
+    writeFile(self.entry(testPath), marshal.dumps(
+      (fixtures, (testName, passed, skipped, info))
+    ))
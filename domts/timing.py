@@ -0,0 +1,69 @@
+""" domts.timing: split the time taken by each test into phases, to show
+    whether it goes on the harness or on the implementation being tested.
+"""
+
+__all__= ['PhaseClock', 'PHASES', 'measured', 'timer', 'cpuTimer']
+
+from timeit import default_timer as timer
+try:
+  from time import process_time as cpuTimer
+except ImportError:
+  # On Windows time.clock measures wall time, so CPU times there are not
+  # worth much.
+  #
+  from time import clock as cpuTimer
+
+# Phases of a test, in the order they are reported: reading the test document
+# (with domts.tsml, or the work implementation if tsml can't, or from the
+# document cache), beginTest on the test implementation, loading fixture
+# documents, calls into the DOM under test, everything else the interpreter
+# does, and collecting garbage after the test.
+#
+PHASES= ('parse', 'begin', 'load', 'dom', 'interpreter', 'gc')
+
+def measured(call, *args):
+  """ Call a function, returning its result and a (wall, cpu) tuple of the
+      seconds it took.
+  """
+  start= timer()
+  startCPU= cpuTimer()
+  result= apply(call, args)
+  return (result, (timer()-start, cpuTimer()-startCPU))
+
+
+class PhaseClock:
+  """ Profiler for a Tester that adds up the wall and CPU time spent loading
+      documents and in DOM calls. As with benchmark.DOMClock, calls made from
+      callbacks inside a DOM call are not counted twice. Another profiler may
+      be given to pass calls on to as well.
+  """
+  def __init__(self, profiler= None):
+    self.profiler= profiler
+    self.depth= 0
+    self.reset()
+
+  def reset(self):
+    self.times= {'load': [0.0, 0.0], 'dom': [0.0, 0.0]}
+
+  def timed(self, kind, name, call):
+    if self.profiler is not None:
+      call= self.profiler.timed(kind, name, call)
+    if kind=='element':
+      return call
+    if kind=='load':
+      phase= 'load'
+    else:
+      phase= 'dom'
+    def timedCall(*args):
+      self.depth= self.depth+1
+      start= timer()
+      startCPU= cpuTimer()
+      try:
+        return apply(call, args)
+      finally:
+        self.depth= self.depth-1
+        if self.depth==0:
+          times= self.times[phase]
+          times[0]= times[0]+(timer()-start)
+          times[1]= times[1]+(cpuTimer()-startCPU)
+    return timedCall
@@ -0,0 +1,252 @@
+""" domts.tsml: slim in-memory form of TSML test and suite documents. Provides
+    just the parts of the DOM the interpreter uses when compiling a test. Can
+    be read straight from a file with expat, made from a document parsed by
+    any DOM, and converted to and from nested tuples for storing with marshal.
+"""
+
+__all__= [
+  'Document', 'Element', 'Text', 'CDATASection', 'EntityReference', 'parse',
+  'ParseError', 'fromDOM'
+]
+
+import os
+from xml.parsers import expat
+try: True
+except NameError: globals()['True'],globals()['False']= not None, not not None
+
+ParseError= expat.ExpatError
+
+
+class Node(object):
+  __slots__= ()
+  ELEMENT_NODE= 1
+  TEXT_NODE= 3
+  CDATA_SECTION_NODE= 4
+  ENTITY_REFERENCE_NODE= 5
+  DOCUMENT_NODE= 9
+  childNodes= ()
+  elements= ()
+
+class Document(Node):
+  __slots__= ('documentElement', 'childNodes', 'elements')
+  nodeType= Node.DOCUMENT_NODE
+  nodeName= '#document'
+  def __init__(self, documentElement):
+    self.documentElement= documentElement
+    self.childNodes= (documentElement,)
+    self.elements= self.childNodes
+  def getElementsByTagName(self, tagName):
+    return self.documentElement.getElementsByTagName(tagName, True)
+
+class Element(Node):
+  """ An element, with its attributes as a dictionary of name to value. As
+      well as childNodes, has elements: a tuple of just the child elements.
+  """
+  __slots__= ('tagName', 'attributes', 'childNodes', 'elements')
+  nodeType= Node.ELEMENT_NODE
+  def __init__(self, tagName, attributes, childNodes):
+    self.tagName= tagName
+    self.attributes= attributes
+    self.childNodes= childNodes
+    elements= []
+    for child in childNodes:
+      if child.nodeType==Node.ELEMENT_NODE:
+        elements.append(child)
+    self.elements= tuple(elements)
+  def nodeName(self):
+    return self.tagName
+  nodeName= property(nodeName)
+  def getAttribute(self, name):
+    return self.attributes.get(name, '')
+  def hasAttribute(self, name):
+    return self.attributes.has_key(name)
+  def getElementsByTagName(self, tagName, includeSelf= False):
+    """ Return a list of descendant elements (in document order) with a given
+        tagName, or all of them for '*'.
+    """
+    elements= []
+    if includeSelf and (tagName=='*' or self.tagName==tagName):
+      elements.append(self)
+    addElementsByTagName(self, tagName, elements)
+    return elements
+
+class Text(Node):
+  __slots__= ('data',)
+  nodeType= Node.TEXT_NODE
+  nodeName= '#text'
+  def __init__(self, data):
+    self.data= data
+
+class CDATASection(Text):
+  __slots__= ()
+  nodeType= Node.CDATA_SECTION_NODE
+  nodeName= '#cdata-section'
+
+class EntityReference(Node):
+  __slots__= ('nodeName', 'childNodes', 'elements')
+  nodeType= Node.ENTITY_REFERENCE_NODE
+  def __init__(self, nodeName, childNodes):
+    self.nodeName= nodeName
+    self.childNodes= childNodes
+    self.elements= ()
+
+def addElementsByTagName(node, tagName, elements):
+  for child in node.childNodes:
+    if child.nodeType==Node.ELEMENT_NODE:
+      if tagName=='*' or child.tagName==tagName:
+        elements.append(child)
+    addElementsByTagName(child, tagName, elements)
+
+
+# Reading files with expat. External entities (the DTD, and entity files
+# such as dom3tests.ent that Level 3 tests include) are read relative to the
+# file referring to them; missing ones are taken to be empty, as a non-
+# validating parser would. Entity references are always expanded.
+#
+def parse(path):
+  """ Read a TSML file into a Document. Raise ParseError if it is not well-
+      formed.
+  """
+  return Reader().parse(path)
+
+class Reader:
+  def __init__(self):
+    self.stack= [[]]
+    self.text= []
+    self.cdata= False
+    self.parsers= []
+
+  def parse(self, path):
+    parser= expat.ParserCreate()
+    self.parsers.append(parser)
+    self.setHandlers(parser)
+    parser.SetParamEntityParsing(expat.XML_PARAM_ENTITY_PARSING_ALWAYS)
+    parser.SetBase(os.path.abspath(path))
+    f= open(path, 'rb')
+    try:
+      parser.ParseFile(f)
+    finally:
+      f.close()
+    for node in self.stack[0]:
+      if node.nodeType==Node.ELEMENT_NODE:
+        return Document(node)
+    raise ParseError('No document element in %s' % path)
+
+  def setHandlers(self, parser):
+    parser.StartElementHandler= self.startElement
+    parser.EndElementHandler= self.endElement
+    parser.CharacterDataHandler= self.characterData
+    parser.StartCdataSectionHandler= self.startCdata
+    parser.EndCdataSectionHandler= self.endCdata
+    parser.ExternalEntityRefHandler= self.externalEntity
+
+  def flush(self):
+    if len(self.text)!=0:
+      data= ''.join(self.text)
+      self.text= []
+      if self.cdata:
+        self.stack[-1].append(CDATASection(data))
+      else:
+        self.stack[-1].append(Text(data))
+
+  def startElement(self, name, attributes):
+    self.flush()
+    self.stack.append([name, attributes])
+  def endElement(self, name):
+    self.flush()
+    children= self.stack.pop()
+    self.stack[-1].append(Element(children[0], children[1], tuple(children[2:])))
+  def characterData(self, data):
+    self.text.append(data)
+  def startCdata(self):
+    self.flush()
+    self.cdata= True
+  def endCdata(self):
+    self.flush()
+    self.cdata= False
+
+  def externalEntity(self, context, base, systemId, publicId):
+    if systemId is None:
+      return 1
+    path= os.path.join(os.path.dirname(base or ''), systemId)
+    try:
+      f= open(path, 'rb')
+    except IOError:
+      return 1
+    try:
+      parser= self.parsers[-1].ExternalEntityParserCreate(context)
+      parser.SetBase(path)
+      self.parsers.append(parser)
+      try:
+        parser.ParseFile(f)
+      finally:
+        self.parsers.pop()
+    finally:
+      f.close()
+    return 1
+
+
+# Conversion from a work DOM
+#
+def fromDOM(document):
+  """ Make a slim copy of a TSML Document from any DOM implementation.
+  """
+  return Document(fromDOMNode(document.documentElement))
+
+def fromDOMNode(node):
+  if node.nodeType==node.ELEMENT_NODE:
+    attributes= {}
+    for ix in range(node.attributes.length):
+      attr= node.attributes.item(ix)
+      attributes[attr.name]= attr.value
+    return Element(node.tagName, attributes, fromDOMChildren(node))
+  if node.nodeType==node.TEXT_NODE:
+    return Text(node.data)
+  if node.nodeType==node.CDATA_SECTION_NODE:
+    return CDATASection(node.data)
+  if node.nodeType==node.ENTITY_REFERENCE_NODE:
+    return EntityReference(node.nodeName, fromDOMChildren(node))
+  return None
+
+def fromDOMChildren(node):
+  children= []
+  for child in node.childNodes:
+    slim= fromDOMNode(child)
+    if slim is not None:
+      children.append(slim)
+  return tuple(children)
+
+
+# Conversion to and from nested tuples, which marshal can store. Text and
+# CDATA nodes are (nodeType, data), elements (nodeType, tagName, attributes,
+# children) and entity references (nodeType, nodeName, children).
+#
+def toTuples(node):
+  if node.nodeType==Node.DOCUMENT_NODE:
+    return toTuples(node.documentElement)
+  if node.nodeType in (Node.TEXT_NODE, Node.CDATA_SECTION_NODE):
+    return (node.nodeType, node.data)
+  children= []
+  for child in node.childNodes:
+    children.append(toTuples(child))
+  if node.nodeType==Node.ELEMENT_NODE:
+    return (node.nodeType, node.tagName, node.attributes, tuple(children))
+  return (node.nodeType, node.nodeName, tuple(children))
+
+def fromTuples(data):
+  """ Make a Document from the nested tuples made by toTuples.
+  """
+  return Document(fromTuplesNode(data))
+
+def fromTuplesNode(data):
+  nodeType= data[0]
+  if nodeType==Node.TEXT_NODE:
+    return Text(data[1])
+  if nodeType==Node.CDATA_SECTION_NODE:
+    return CDATASection(data[1])
+  children= []
+  for child in data[-1]:
+    children.append(fromTuplesNode(child))
+  if nodeType==Node.ELEMENT_NODE:
+    return Element(data[1], data[2], tuple(children))
+  return EntityReference(data[1], tuple(children))
@@ -1,13 +1,36 @@
 #!/usr/bin/env python
 
-from domts import runSuite, implementations
+from domts import iterSuite, iterBenchmark, Reporter, implementations
+from domts.reporting import ResultWriter
+from domts.benchmark import summarise
+from domts.profiling import Profiler
 
 import sys, getopt
 
-__usage__= 'use: rundomtests.py [--testdom=...] [--workdom=...] test.xml'
+__usage__= '''use: rundomtests.py [options] test.xml
+options: --testdom=name --workdom=name --jobs=n --cache=dir --cache-fixtures
+         --store=dir --rerun --benchmark --repeat=n --warmup=n
+         --profile=file.json --timings --index=dir --timeout=s --memory=mb
+         --temp=dir --results=file.jsonl --iteration=auto|snapshot|stream
+'''
+
+def number(value, minimum= None):
+  try:
+    n= int(value)
+  except ValueError:
+    n= None
+  if n is None or (minimum is not None and n<minimum):
+    sys.stderr.write(__usage__)
+    sys.exit(1)
+  return n
 
 try:
-  opts, args= getopt.getopt(sys.argv[1:], '', ['testdom=','workdom=','tempuri='])
+  opts, args= getopt.getopt(sys.argv[1:], '', [
+    'testdom=', 'workdom=', 'tempuri=', 'jobs=', 'cache=', 'cache-fixtures',
+    'store=', 'rerun', 'benchmark', 'repeat=', 'warmup=',
+    'profile=', 'timings', 'index=', 'timeout=', 'memory=',
+    'temp=', 'results=', 'iteration='
+  ])
 except getopt.GetoptError, e:
   sys.stderr.write(__usage__)
   sys.exit(1)
@@ -15,37 +38,89 @@ if len(args)!=1:
   sys.stderr.write(__usage__)
   sys.exit(1)
 testdom= 'minidom'
-workdom= 'minidom'
+workdom= None
+jobs= 1
+bench= False
+profile= None
+results= None
+benchOptions= {}
+options= {}
 for (opt, value) in opts:
   if opt=='--testdom':
     testdom= value
   elif opt=='--workdom':
     workdom= value
+  elif opt=='--cache':
+    options['cacheDir']= value
+  elif opt=='--cache-fixtures':
+    options['cacheFixtures']= True
+  elif opt=='--store':
+    options['storeDir']= value
+  elif opt=='--rerun':
+    options['rerun']= True
+  elif opt=='--jobs':
+    jobs= number(value, 1)
+  elif opt=='--benchmark':
+    bench= True
+  elif opt=='--repeat':
+    benchOptions['repeat']= number(value, 1)
+  elif opt=='--warmup':
+    benchOptions['warmup']= number(value, 0)
+  elif opt=='--profile':
+    profile= value
+  elif opt=='--timings':
+    options['timings']= True
+  elif opt=='--index':
+    options['indexDir']= value
+  elif opt=='--timeout':
+    options['timeout']= number(value, 1)
+  elif opt=='--memory':
+    options['memoryLimit']= number(value, 1)*1024*1024
+  elif opt=='--temp':
+    options['tempRoot']= value
+  elif opt=='--results':
+    results= value
+  elif opt=='--iteration':
+    if value not in ('auto', 'snapshot', 'stream'):
+      sys.stderr.write(__usage__)
+      sys.exit(1)
+    options['iteration']= value
 testimp= implementations.IMPLEMENTATIONS[testdom.lower()]()
-workimp= implementations.IMPLEMENTATIONS[workdom.lower()]()
-
-results= runSuite(args[0], testimp, workimp)
-
-passed= []
-failed= []
-skipped= []
-for result in results:
-  if result[2]:
-    skipped.append(result)
-  elif result[1]:
-    passed.append(result)
-  else:
-    failed.append(result)
+workimp= None
+if workdom is not None:
+  workimp= implementations.IMPLEMENTATIONS[workdom.lower()]()
 
-if len(failed)==0 and len(skipped)==0:
-  print 'PASSED ALL %d tests!' % len(passed)
+if bench:
+  # Benchmark mode: a tab-separated table of DOM time per passing test, in
+  # microseconds, with the median of the total time including the
+  # interpreter for comparison.
+  #
+  options.update(benchOptions)
+  print 'implementation\ttest\truns\tmin\tmedian\tp95\ttotal'
+  for (testName, domTimes, totalTimes) in apply(iterBenchmark,
+    (args[0], testimp, workimp), options
+  ):
+    (minimum, median, p95)= summarise(domTimes)
+    total= summarise(totalTimes)[1]
+    print '%s\t%s\t%d\t%.1f\t%.1f\t%.1f\t%.1f' % (
+      testimp.implementationName, testName, len(domTimes),
+      minimum*1e6, median*1e6, p95*1e6, total*1e6
+    )
+    sys.stdout.flush()
 else:
-  print 'PASSED %d test%s' % (len(passed), ['s', ''][len(passed)==1])
-if len(failed)!=0:
-  print 'FAILED %d test%s:' % (len(failed), ['s', ''][len(failed)==1])
-  for fail in failed:
-    print '  %s: %s' % (fail[0], fail[3])
-if len(skipped)!=0:
-  print 'SKIPPED %d test%s:' % (len(skipped), ['s', ''][len(skipped)==1])
-  for skip in skipped:
-    print '  %s: %s' % (skip[0], skip[3])
+  if profile is not None:
+    options['profiler']= Profiler(testimp.implementationName)
+  reporter= Reporter(sys.stderr)
+  writer= None
+  if results is not None:
+    out= open(results, 'a')
+    writer= ResultWriter(out)
+  for result in apply(iterSuite, (args[0], testimp, workimp, jobs), options):
+    reporter.add(result)
+    if writer is not None:
+      writer.add(result)
+  if writer is not None:
+    out.close()
+  reporter.summarise(sys.stdout)
+  if profile is not None:
+    options['profiler'].write(profile)